@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from progress.bar import Bar
+
+from toolbox.column_store import ColumnStore, get_column_store_folder
+from toolbox.data_manager import CNumber, DataManager
+from toolbox.lab import init_log, stash_log_file
+
+
+def run(logger, config, data_manager):
+    start = config.local.start
+
+    init_log(logger, config, start)
+
+    data_filepath = config.local.data_filepath
+    column_store_folder = get_column_store_folder(data_filepath)
+    logger.info(f'Converting {data_filepath} into {column_store_folder}')
+    source = DataManager(data_filepath)
+    target = ColumnStore(column_store_folder)
+    value_bounds = source.get_value_bounds()
+    if value_bounds is None:
+        logger.info('The db holds no data')
+        stash_log_file(config, 'CONVERT')
+        return
+
+    chunk_size = config.files.convert_chunk_size
+    columns = [column.name for column in CNumber.__table__.columns]
+    lower, upper = value_bounds
+    step_start = datetime.now()
+    converted = 0
+    with Bar('Converting', max=upper - lower) as bar:
+        for chunk_lower in range(lower, upper, chunk_size):
+            chunk_upper = min(chunk_lower + chunk_size, upper)
+            data = source.load_range(chunk_lower, chunk_upper, columns)
+            target.save_data(data)
+            converted += len(data)
+            bar.next(chunk_upper - chunk_lower)
+    step_end = datetime.now()
+    logger.info(f'{converted} numbers converted')
+    logger.info(f'DB size: {source.get_db_size()} bytes, column store size: {target.get_db_size()} bytes')
+    logger.debug(f'...done in {step_end-step_start}')
+
+    end = datetime.now()
+    logger.info(f'End at {end}')
+    logger.info(f'Total time: {end-start}')
+
+    logger_filename_prefix = 'CONVERT'
+    stash_log_file(config, logger_filename_prefix)
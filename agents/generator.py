@@ -1,34 +1,42 @@
-import copy
 import multiprocessing
-import os
 import sys
-from datetime import datetime
-from multiprocessing import Queue
+from datetime import datetime, timedelta
 
 import pandas as pd
-from progress.bar import Bar
 
-from toolbox.data_manager import DataManager
+from toolbox.data_manager import DataWriter
 from toolbox.generators import (
-    BBPathCalculator,
-    FullPropertiesCalculator,
+    MemoizedCalculator,
+    StagePool,
     TailCalculator,
+    VectorizedCalculator,
+    get_overflow_value,
+    resolve_full_paths,
+    resolve_properties,
 )
-from toolbox.lab import init_log, is_bb, stash_log_file
+from toolbox.lab import get_profiler, init_log, stash_log_file, stash_metrics, stash_profile
+from toolbox.metrics import RunMetrics
+from toolbox.shared_columns import SharedColumns
+
+
+ENGINES = ['pipeline', 'memoized', 'vectorized']
 
 
 def run(logger, config, data_manager):
     start = config.local.start
 
     upper_bound = config.data.upper_bound
-    cpu_count = multiprocessing.cpu_count()
-    process_count = cpu_count
-    pr_limit = int(upper_bound / (process_count - 1))
-    # TEMP
-    # process_count = 1
-    # pr_limit = limit
+    engine = config.engine.engine
     init_log(logger, config, start)
-    logger.info(f'* Process count: {process_count}')
+    logger.info(f'* Engine: {engine}')
+
+    if engine not in ENGINES:
+        logger.error(f'Generation engine {engine} is not supported')
+        sys.exit(1)
+    if config.engine.stream and engine == 'pipeline':
+        logger.warning('The pipeline engine can not stream, the whole range will be saved at once and the run can not be resumed')
+    if config.engine.incremental and engine == 'pipeline':
+        logger.warning('The pipeline engine can not extend stored data, the whole range will be calculated')
 
     if data_manager.data_already_exists(config):
         end = datetime.now()
@@ -37,128 +45,30 @@ def run(logger, config, data_manager):
         logger.info(f'Total time: {end-start}')
         sys.exit(0)
 
-    # create proto number collection
-    logger.info('Creating proto collection...')
-    step_start = datetime.now()
-    proto_collection = []
-    for value in range(2, upper_bound):
-        proto_number = {}
-        proto_number['value'] = value
-        proto_number['is_bb'] = is_bb(value)
-        proto_number['target'] = int(value / 2) if proto_number['is_bb'] else 0
-        proto_collection.append(proto_number)
-    step_end = datetime.now()
-    logger.debug(f'...done in {step_end-step_start}')
-
-    # calculate tails
-    logger.info('Calculating first tails...')
-    step_start = datetime.now()
-    tail_calculators = []
-    tail_queue = Queue()
-    for counter in range(process_count):
-        bound_lower = pr_limit * counter + 1 if counter > 0 else pr_limit * counter
-        bound_upper = pr_limit * (counter + 1)
-        local_collection = [record for record in proto_collection if record['value'] in range(bound_lower, bound_upper + 1)]
-        tail_calculators.append(TailCalculator(queue=tail_queue, local_lower=bound_lower, local_upper=bound_upper, local_collection=local_collection, limit=upper_bound))
-
-    for calculator in tail_calculators:
-        calculator.start()
-    
-    tails_collection = []
-    tail_process_count = process_count
-    while tail_process_count > 0:
-        result = tail_queue.get()
-        tails_collection.extend(result)
-        tail_process_count -= 1
-    step_end = datetime.now()
-    logger.debug(f'...done in {step_end-step_start}')
-
-    # calculate bb paths
-    logger.info('Creating backbone...')
-    step_start = datetime.now()
-    bb_path_calculators = []
-    bb_path_queue = Queue()
-    for counter in range(process_count):
-        bound_lower = pr_limit * counter + 1 if counter > 0 else pr_limit * counter
-        bound_upper = pr_limit * (counter + 1)
-        local_collection = [record for record in tails_collection if record['value'] in range(bound_lower, bound_upper + 1)]
-        bb_path_calculators.append(BBPathCalculator(queue=bb_path_queue, local_collection=local_collection))
-
-    for calculator in bb_path_calculators:
-        calculator.start()
-
-    bb_path_collection = []
-    bb_path_process_count = process_count
-    while bb_path_process_count > 0:
-        result = bb_path_queue.get()
-        bb_path_collection.extend(result)
-        bb_path_process_count -= 1
-    step_end = datetime.now()
-    logger.debug(f'...done in {step_end-step_start}')
-
-
-    # split calculated by tail
-    logger.info('Collating full paths...')
-    step_start = datetime.now()
-    all_paths_collection = copy.deepcopy(bb_path_collection)
-
-    complete_tails_to_be_processed = []
-    incomplete_tails = []
-    for record in all_paths_collection:
-        complete_tails_to_be_processed.append(record) if record['tail'] == 1 else incomplete_tails.append(record)
-    complete_tails = copy.deepcopy(complete_tails_to_be_processed)
-    
-    # process unprocessed_queue
-    with Bar('Collating tails', max = len(incomplete_tails)) as bar:
-        while len(complete_tails_to_be_processed) > 0:
-            record = complete_tails_to_be_processed.pop()
-            # find parents
-            parents_tail = record['value']
-            parents = [record for record in incomplete_tails if record['tail'] == parents_tail]
-            if len(parents) > 0:
-                complete_tails_to_be_processed.extend(parents)
-                for parent in parents:
-                    parent['tail_path'].extend(record['tail_path'])
-                    parent['tail'] = record['tail']
-                    complete_tails.append(parents)
-                    incomplete_tails.remove(parent)
-            bar.next(n=len(parents))
-
-    step_end = datetime.now()
-    logger.debug(f'...done in {step_end-step_start}')
-
-    # calculate additional parameters
-    logger.info('Calculating parameters...')
-    step_start = datetime.now()
-    cnumber_calculators = []
-    cnumber_queue = Queue()
-    for counter in range(process_count):
-        bound_lower = pr_limit * counter + 1 if counter > 0 else pr_limit * counter
-        bound_upper = pr_limit * (counter + 1)
-        local_collection = [record for record in all_paths_collection if record['value'] in range(bound_lower, bound_upper + 1)]
-        cnumber_calculators.append(FullPropertiesCalculator(queue=cnumber_queue, local_collection=local_collection))
-
-    for calculator in cnumber_calculators:
-        calculator.start()
-
-    cnumber_collection = []
-    cnumber_process_count = process_count
-    while cnumber_process_count > 0:
-        result = cnumber_queue.get()
-        cnumber_collection.extend(result)
-        cnumber_process_count -= 1
-
-    step_end = datetime.now()
-    logger.debug(f'...done in {step_end-step_start}')
-
-    logger.info('Saving dataframe to db')
-    collection_df = pd.DataFrame.from_dict(cnumber_collection)
-    collection_df.drop(columns=['target', 'tail', 'tail_path'], inplace=True)
-    data_filename = config.files.data_file_name
-    data_folder = config.local.data_folder
-    data_filepath = os.path.join(data_folder, data_filename)
-    data_manager = DataManager(data_filepath)
-    data_manager.save_data(collection_df)
+    profiler = get_profiler(config, 'GEN')
+    metrics = RunMetrics(profiler)
+    data_manager.metrics = metrics
+    if profiler is not None and profiler.stage is None:
+        profiler.enable()
+    if engine != 'pipeline':
+        calculator = get_calculator(config, upper_bound)
+        ranges = get_ranges(logger, config, calculator, data_manager, upper_bound, metrics)
+
+    completed = True
+    if engine != 'pipeline' and len(ranges) == 0:
+        logger.info('All values are already in the db. No new data will be generated')
+    elif config.engine.stream and engine != 'pipeline':
+        completed = generate_streaming(logger, config, calculator, ranges, data_manager, metrics)
+        log_progress(logger, config, data_manager)
+    else:
+        if engine == 'pipeline':
+            collection_df = generate_pipeline(logger, config, upper_bound, metrics)
+        else:
+            collection_df = generate_calculated(logger, calculator, ranges, metrics)
+
+        logger.info('Saving dataframe to db')
+        with metrics.stage('Saving dataframe to db', logger, rows=len(collection_df)):
+            data_manager.save_data(collection_df)
 
     end = datetime.now()
     logger.info(f'End at {end}')
@@ -166,7 +76,201 @@ def run(logger, config, data_manager):
 
     # deal with the logger file
     logger_filename_prefix = 'GEN'
+    stash_profile(logger, config, profiler)
+    stash_metrics(config, logger_filename_prefix, metrics)
     stash_log_file(config, logger_filename_prefix)
+    if not completed:
+        sys.exit(1)
+
+
+def get_run_start(config) -> str:
+    '''Identifies the progress blocks committed by the run'''
+    return config.local.start.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def get_calculator(config, upper_bound) -> MemoizedCalculator:
+    # the successor storage model rebuilds the paths from the db, so they are not calculated
+    full_path = config.engine.full_path and config.files.storage_model == 'paths'
+    memo_limit = config.engine.memo_limit
+    jump_bits = config.engine.jump_bits
+    path_memo_limit = config.engine.path_memo_limit
+    if config.engine.engine == 'vectorized':
+        block_size = config.engine.block_size
+        return VectorizedCalculator(limit=upper_bound, full_path=full_path, block_size=block_size, memo_limit=memo_limit,
+                                    jump_bits=jump_bits, path_memo_limit=path_memo_limit)
+
+    return MemoizedCalculator(limit=upper_bound, full_path=full_path, memo_limit=memo_limit, jump_bits=jump_bits,
+                              path_memo_limit=path_memo_limit)
+
+
+def get_ranges(logger, config, calculator, data_manager, upper_bound, metrics) -> list:
+    '''
+    Get the value ranges to be calculated
+
+    When extending stored data, only the missing ranges are calculated and
+    the calculator is seeded with the stored numbers, so the paths stop as soon as they reach them
+    '''
+    if not config.engine.incremental:
+        return [(2, upper_bound)]
+
+    logger.info('Looking for missing ranges...')
+    with metrics.stage('Looking for missing ranges', logger) as stage:
+        ranges = data_manager.get_missing_ranges(2, upper_bound)
+        missing_count = sum(upper - lower for lower, upper in ranges)
+        logger.info(f'* Missing values: {missing_count} in {len(ranges)} ranges')
+        if config.engine.stream and missing_count > 0:
+            progress = data_manager.get_progress()
+            if len(progress) > 0:
+                logger.info(f'* Resuming after {len(progress)} committed blocks, up to value {progress["upper"].max() - 1}')
+        if missing_count > 0 and missing_count < upper_bound - 2:
+            stored_data = data_manager.load_properties(2, calculator.memo_limit)
+            calculator.seed(stored_data)
+            stage.rows = len(stored_data)
+            logger.info(f'* Seeded with {len(stored_data)} stored numbers')
+
+    return ranges
+
+
+def generate_calculated(logger, calculator, ranges, metrics) -> pd.DataFrame:
+    logger.info('Calculating numbers...')
+    with metrics.stage('Calculating numbers', logger) as stage:
+        collection_df = calculator.run(ranges)
+        stage.rows = len(collection_df)
+
+    return collection_df
+
+
+def generate_streaming(logger, config, calculator, ranges, data_manager, metrics) -> bool:
+    '''
+    Calculate the numbers chunk by chunk, while a writer process saves the finished chunks
+
+    Each committed chunk is recorded as a progress block, so that an interrupted run is resumed
+    from the committed blocks by the next incremental run
+
+    Returns
+    ------
+    bool
+        False if the run was interrupted
+    '''
+    chunk_size = config.engine.chunk_size
+    run_start = get_run_start(config)
+    logger.info(f'Calculating and saving numbers in chunks of {chunk_size}...')
+    with metrics.stage('Calculating and saving numbers', logger) as stage:
+        stage.rows = 0
+        writer = DataWriter(data_manager.db_filepath, data_manager.save_options, manager_class=type(data_manager))
+        writer.start()
+        interrupted = False
+        try:
+            chunk_start = datetime.now()
+            for chunk_df in calculator.generate_chunks(chunk_size, ranges):
+                chunk_end = datetime.now()
+                chunk_lower = int(chunk_df['value'].iloc[0])
+                chunk_upper = int(chunk_df['value'].iloc[-1])
+                logger.debug(f'Chunk {chunk_lower} to {chunk_upper} calculated in {chunk_end-chunk_start}')
+                block = {
+                    'lower': chunk_lower,
+                    'upper': chunk_upper + 1,
+                    'rows': len(chunk_df),
+                    'calculate_seconds': (chunk_end - chunk_start).total_seconds(),
+                    'save_seconds': None,
+                    'run_start': run_start,
+                }
+                with metrics.stage('Handing chunk over to the writer', rows=len(chunk_df)):
+                    writer.write(chunk_df, block)
+                stage.rows += len(chunk_df)
+                chunk_start = datetime.now()
+        except KeyboardInterrupt:
+            logger.warning('Interrupted, saving the calculated chunks. Run again to resume from the last committed block')
+            interrupted = True
+        finally:
+            writer.close()
+        if writer.exitcode != 0:
+            raise RuntimeError(f'The data writer failed with exit code {writer.exitcode}')
+
+    return not interrupted
+
+
+def log_progress(logger, config, data_manager):
+    '''Log the timing of the blocks committed by the run'''
+    progress = data_manager.get_progress()
+    run_progress = progress[progress['run_start'] == get_run_start(config)]
+    logger.info(f'Committed blocks: {len(run_progress)} in this run, {len(progress) - len(run_progress)} in earlier runs')
+    for block in run_progress.itertuples():
+        logger.info(f'* Block {block.lower} to {block.upper - 1}: {block.rows} values, '
+                    f'calculated in {timedelta(seconds=block.calculate_seconds)}, saved in {timedelta(seconds=block.save_seconds)}')
+    if len(run_progress) > 0:
+        logger.info(f'* Total: {run_progress["rows"].sum()} values, '
+                    f'calculated in {timedelta(seconds=run_progress["calculate_seconds"].sum())}, '
+                    f'saved in {timedelta(seconds=run_progress["save_seconds"].sum())}')
+
+
+def generate_pipeline(logger, config, upper_bound, metrics) -> pd.DataFrame:
+    '''
+    Calculate the tails in the worker processes and the parameters from the tails
+
+    The workers read the values and write the tails into shared memory columns, so only the row ranges and the specs
+    of the columns pass through the queues. The full paths are collated from the tails only when they are stored
+    '''
+    full_path = config.engine.full_path and config.files.storage_model == 'paths'
+    process_count = multiprocessing.cpu_count()
+    logger.info(f'* Process count: {process_count}')
+
+    # create the shared value column
+    logger.info('Creating proto collection...')
+    with metrics.stage('Creating proto collection', logger) as stage:
+        tail_columns = TailCalculator.create_columns(2, upper_bound)
+        stage.rows = tail_columns.length
+
+    excursion_columns = []
+    try:
+        with StagePool(process_count, metrics.profiler) as pool:
+            # calculate tails
+            logger.info('Calculating first tails...')
+            with metrics.stage('Calculating first tails', logger) as stage:
+                stage_parameters = []
+                for row_lower, row_upper in get_row_ranges(process_count, tail_columns.length):
+                    stage_parameters.append({'columns_spec': tail_columns.get_spec(), 'row_lower': row_lower, 'row_upper': row_upper,
+                                             'limit': upper_bound, 'full_path': full_path})
+
+                for row_lower, excursion_spec in sorted(pool.run_stage(TailCalculator, stage_parameters), key=lambda result: result[0]):
+                    if excursion_spec is not None:
+                        excursion_columns.append(SharedColumns.attach(excursion_spec))
+                stage.rows = tail_columns.length
+                stage.workers = pool.stage_metrics
+
+        overflow_value = get_overflow_value(tail_columns.arrays)
+        if overflow_value is not None:
+            MemoizedCalculator.raise_peak_overflow(overflow_value)
+
+        # calculate the parameters from the tails
+        logger.info('Calculating parameters...')
+        with metrics.stage('Calculating parameters', logger) as stage:
+            collection_df, unresolved_count = resolve_properties(tail_columns.arrays, 2)
+            if unresolved_count > 0:
+                logger.error(f'{unresolved_count} numbers were not calculated')
+            stage.rows = len(collection_df) - unresolved_count
+
+        if full_path:
+            # the backbone paths are known, the other paths are extended from them
+            logger.info('Collating full paths...')
+            with metrics.stage('Collating full paths', logger) as stage:
+                excursions = [columns.arrays['node'] for columns in excursion_columns]
+                full_paths = resolve_full_paths(tail_columns.arrays, 2, excursions)
+                del excursions
+                stage.rows = len(full_paths)
+            collection_df.insert(2, 'full_path', full_paths)
+    finally:
+        tail_columns.release()
+        for columns in excursion_columns:
+            columns.release()
+
+    return collection_df
+
+
+def get_row_ranges(process_count: int, length: int) -> list:
+    '''Split the rows between the worker processes'''
+    bounds = [length * counter // process_count for counter in range(process_count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from toolbox.lab import init_log, stash_log_file
+
+
+def run(logger, config, data_manager):
+    start = config.local.start
+
+    init_log(logger, config, start)
+
+    size_before = data_manager.get_db_size()
+    load_time_before = time_load(config, data_manager)
+    logger.info(f'DB size before: {size_before} bytes')
+    logger.info(f'Load time before: {load_time_before}')
+
+    logger.info('Encoding paths as parity bits...')
+    step_start = datetime.now()
+    migrated = data_manager.migrate_paths(batch_size=config.files.save_batch_size)
+    step_end = datetime.now()
+    logger.info(f'{migrated} paths migrated')
+    logger.debug(f'...done in {step_end-step_start}')
+
+    logger.info('Rebuilding coverage records...')
+    step_start = datetime.now()
+    intervals = data_manager.rebuild_coverage()
+    step_end = datetime.now()
+    logger.info(f'{len(intervals)} stored value intervals')
+    logger.debug(f'...done in {step_end-step_start}')
+
+    size_after = data_manager.get_db_size()
+    load_time_after = time_load(config, data_manager)
+    logger.info(f'DB size after: {size_after} bytes ({size_after / max(size_before, 1):.4f} of the original)')
+    logger.info(f'Load time after: {load_time_after}')
+
+    end = datetime.now()
+    logger.info(f'End at {end}')
+    logger.info(f'Total time: {end-start}')
+
+    logger_filename_prefix = 'MIGRATE'
+    stash_log_file(config, logger_filename_prefix)
+
+
+def time_load(config, data_manager):
+    '''Time a load of the configured data range'''
+    load_start = datetime.now()
+    data_manager.load_data(config)
+    return datetime.now() - load_start
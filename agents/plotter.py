@@ -1,21 +1,32 @@
+import os
 from datetime import datetime
 
 from toolbox.lab import (
+    decimate_data,
     generate_hard_copy_filename,
     generate_plot,
     get_data,
+    get_profiler,
     init_log,
     prep_output_folder,
     prepare_data,
     stash_graph_html,
     stash_log_file,
+    stash_metrics,
+    stash_profile,
 )
+from toolbox.metrics import RunMetrics
 
 
 def run(logger, config, data_manager):
     start = config.local.start
 
     init_log(logger, config, start)
+    profiler = get_profiler(config, 'PLOT')
+    metrics = RunMetrics(profiler)
+    data_manager.metrics = metrics
+    if profiler is not None and profiler.stage is None:
+        profiler.enable()
 
     logger.info('Loading data')
     logger.debug('Getting data filename')
@@ -23,19 +34,41 @@ def run(logger, config, data_manager):
     
     # set_clamp_filter(logger, config)
 
-    data = get_data(logger, config, data_manager)
+    with metrics.stage('Loading data', logger) as stage:
+        data = get_data(logger, config, data_manager)
+        stage.rows = len(data)
 
     # prepare data for plot
     logger.info('Preparing data')
-    data = prepare_data(config, data, upper_bound)
+    with metrics.stage('Preparing data', logger) as stage:
+        data = prepare_data(config, data, upper_bound)
+        stage.rows = len(data)
+
+    if config.plot.decimate:
+        logger.info('Decimating data')
+        with metrics.stage('Decimating data', logger) as stage:
+            point_count = len(data)
+            stage.rows = point_count
+            data = decimate_data(config, data)
+            config.add_parameter('local', 'dropped_points', point_count - len(data))
+            logger.info(f'Kept {len(data)} of {point_count} points')
 
     # plot data
     html_filepath = config.local.html_filepath
     project_title = config.local.project_title
-    plot = generate_plot(logger, config, data, project_title, html_filepath)
+    with metrics.stage('Generating plot', logger, rows=len(data)) as stage:
+        plot = generate_plot(logger, config, data, project_title, html_filepath)
+        stage.extras['payload_bytes'] = config.local.plot_payload_bytes
+    logger.info(f'Plot payload: {config.local.plot_payload_bytes} bytes for {len(data)} points')
 
-    plot.display_plot()
+    # the html is written here; the time the browser takes to render it is not measured
+    with metrics.stage('Displaying plot', rows=len(data)) as stage:
+        plot.display_plot()
+        if os.path.isfile(html_filepath):
+            stage.extras['html_bytes'] = os.path.getsize(html_filepath)
     logger.info('Displaying plot')
+    if 'html_bytes' in stage.extras:
+        logger.info(f'HTML size: {stage.extras["html_bytes"]} bytes for {len(data)} points')
 
 
     # Save output
@@ -48,6 +81,8 @@ def run(logger, config, data_manager):
     prep_output_folder(config)
     stash_graph_html(hard_copy_filename)
     logger_filename_prefix = 'PLOT'
+    stash_profile(logger, config, profiler)
+    stash_metrics(config, logger_filename_prefix, metrics)
     stash_log_file(config, logger_filename_prefix)
 
 if __name__ == "__main__":
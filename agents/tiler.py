@@ -0,0 +1,46 @@
+import os
+from datetime import datetime
+
+from toolbox.lab import init_log, stash_log_file
+from toolbox.tiles import PROPERTIES, TileWriter
+
+
+def run(logger, config, data_manager):
+    start = config.local.start
+
+    init_log(logger, config, start)
+
+    # the same values as the plot mode (see DataManager.load_data): lower bound excluded, upper bound included
+    lower_bound = config.local.lower_bound + 1
+    upper_bound = config.local.upper_bound + 1
+    chunk_size = config.tiles.chunk_size
+    tiles_folder = get_tiles_folder(config)
+    logger.info(f'* Tiles folder: {tiles_folder}')
+
+    logger.info('Building tile pyramid...')
+    step_start = datetime.now()
+    writer = TileWriter(tiles_folder, tile_size=config.tiles.tile_size, zoom_factor=config.tiles.zoom_factor)
+    for chunk_lower in range(lower_bound, upper_bound, chunk_size):
+        chunk_start = datetime.now()
+        chunk_upper = min(chunk_lower + chunk_size, upper_bound)
+        data = data_manager.load_range(chunk_lower, chunk_upper, ['value'] + PROPERTIES)
+        writer.add_data(data)
+        logger.debug(f'...{len(data)} numbers from {chunk_lower} to {chunk_upper} aggregated in {datetime.now()-chunk_start}')
+    meta = writer.close()
+    step_end = datetime.now()
+    tile_count = sum(len(indexes) for indexes in meta['tiles'].values())
+    logger.info(f'{meta["levels"]} levels, {tile_count} tiles')
+    logger.debug(f'...done in {step_end-step_start}')
+
+    end = datetime.now()
+    logger.info(f'End at {end}')
+    logger.info(f'Total time: {end-start}')
+
+    logger_filename_prefix = 'TILES'
+    stash_log_file(config, logger_filename_prefix)
+
+
+def get_tiles_folder(config) -> str:
+    '''The tiles of each db are kept in a folder named after it, next to it'''
+    db_name = os.path.splitext(config.files.data_file_name)[0]
+    return os.path.join(config.local.data_folder, 'tiles', db_name)
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from bokeh.events import RangesUpdate
+from bokeh.layouts import column
+from bokeh.models import ColumnDataSource, HoverTool, Select
+from bokeh.plotting import figure
+from bokeh.server.server import Server
+
+import toolbox.mappings as mappings
+from agents.tiler import get_tiles_folder
+from toolbox.lab import init_log, stash_log_file
+from toolbox.tiles import PROPERTIES, TilePyramid
+
+
+def run(logger, config, data_manager):
+    start = config.local.start
+
+    init_log(logger, config, start)
+
+    tiles_folder = get_tiles_folder(config)
+    logger.info(f'Loading tile pyramid from {tiles_folder}')
+    pyramid = TilePyramid(tiles_folder)
+    logger.info(f'* Tiled range: {pyramid.meta["lower"]} to {pyramid.meta["upper"]}, {pyramid.levels} levels')
+
+    def make_document(document):
+        document.add_root(build_view(logger, config, pyramid))
+
+    port = config.tiles.viewer_port
+    server = Server({'/': make_document}, port=port, address='localhost')
+    server.start()
+    logger.info(f'Tile viewer running at http://localhost:{port}/ (Ctrl+C to stop)')
+    server.io_loop.add_callback(server.show, '/')
+    try:
+        server.io_loop.start()
+    except KeyboardInterrupt:
+        logger.info('Tile viewer stopped')
+
+    end = datetime.now()
+    logger.info(f'End at {end}')
+    logger.info(f'Total time: {end-start}')
+
+    logger_filename_prefix = 'VIEW'
+    stash_log_file(config, logger_filename_prefix)
+
+
+def build_view(logger, config, pyramid: TilePyramid):
+    '''
+    Builds the viewer document: the min-max range and the mean of a property per value bin
+
+    On every pan or zoom only the tiles of the level matching the visible range are loaded
+    '''
+    lower = pyramid.meta['lower']
+    upper = pyramid.meta['upper']
+    source = ColumnDataSource(data={'bin_start': [], 'bin_end': [], 'center': [], 'count': [], 'min': [], 'max': [], 'mean': []})
+    plot = figure(width=config.plot.width, height=config.plot.height, x_range=(lower, upper),
+                  tools='xpan,xwheel_zoom,box_zoom,reset,save', active_scroll='xwheel_zoom',
+                  output_backend='webgl' if config.plot.webgl else 'canvas')
+    plot.xaxis.axis_label = 'value'
+    plot.quad(left='bin_start', right='bin_end', bottom='min', top='max', source=source, fill_alpha=0.3, line_alpha=0)
+    mean_renderer = plot.scatter(x='center', y='mean', source=source, size=3)
+    plot.add_tools(HoverTool(renderers=[mean_renderer], tooltips=[('from', '@bin_start'), ('to', '@bin_end'), ('count', '@count'),
+                                                                ('min', '@min'), ('max', '@max'), ('mean', '@mean')]))
+    property_options = [(property, mappings.colorization_title_suffix[property]) for property in PROPERTIES]
+    property_select = Select(title='Property', value=PROPERTIES[0], options=property_options)
+
+    def update():
+        visible_lower = max(int(plot.x_range.start), lower)
+        visible_upper = min(int(plot.x_range.end) + 1, upper)
+        level = pyramid.get_level(visible_lower, visible_upper, config.plot.width)
+        bins = pyramid.load_bins(level, visible_lower, visible_upper)
+        property = property_select.value
+        source.data = {
+            'bin_start': bins['bin_start'].to_numpy(),
+            'bin_end': bins['bin_end'].to_numpy(),
+            'center': ((bins['bin_start'] + bins['bin_end'] - 1) / 2).to_numpy(),
+            'count': bins['count'].to_numpy(),
+            'min': bins[f'{property}_min'].to_numpy(),
+            'max': bins[f'{property}_max'].to_numpy(),
+            'mean': bins[f'{property}_mean'].to_numpy(),
+        }
+        plot.yaxis.axis_label = mappings.colorization_title_suffix[property]
+        plot.title.text = f'Collatz: {mappings.colorization_title_suffix[property]} [ {visible_lower} to {visible_upper} ] [ level {level}, bin width {pyramid.get_bin_width(level)}, {len(bins)} bins ]'
+        logger.debug(f'View {visible_lower} to {visible_upper}: level {level}, {len(bins)} bins')
+
+    plot.on_event(RangesUpdate, lambda event: update())
+    property_select.on_change('value', lambda attr, old, new: update())
+    update()
+
+    return column(property_select, plot)
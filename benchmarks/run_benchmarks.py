@@ -0,0 +1,392 @@
+'''
+Benchmark suite for the generate and plot stages
+
+Each benchmark runs in its own process at each range size, so that its peak RSS is measured in isolation;
+only the measured step is timed, the data it needs is prepared beforehand.
+The generator stages are run in-process (Process.run), which times the stage work without the IPC
+
+python -m benchmarks.run_benchmarks                                  # all benchmarks, sizes 10^3 to 10^6
+python -m benchmarks.run_benchmarks --sizes 1000 1000000 --only tails save
+python -m benchmarks.run_benchmarks --save-baseline                  # store the results as the new baseline
+
+The results are written as JSON into benchmarks/results and compared with benchmarks/baseline.json;
+a benchmark that is slower than its baseline by more than the threshold is flagged as a regression
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import toml
+
+project_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if project_path not in sys.path:
+    sys.path.insert(0, project_path)
+
+import toolbox.lab as lab
+from toolbox import config_filepath
+from toolbox.column_store import ColumnStore
+from toolbox.data_manager import DataManager
+from toolbox.generators import MemoizedCalculator, TailCalculator, VectorizedCalculator, resolve_full_paths, resolve_properties
+from toolbox.shared_columns import SharedColumns
+
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FOLDER = os.path.join(BENCHMARKS_FOLDER, 'results')
+BASELINE_FILEPATH = os.path.join(BENCHMARKS_FOLDER, 'baseline.json')
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_THRESHOLD = 0.2
+# differences below this many seconds are noise, never regressions
+MIN_SECONDS = 0.01
+# memo_limit of the no-path memoized benchmarks, low enough for the walks above it to use the jumps
+WALK_MEMO_LIMIT = 65536
+
+
+class BenchmarkConfig(SimpleNamespace):
+    '''Attribute access to config.toml, as with ConfigAgent, without the pytoolbox dependency'''
+    @classmethod
+    def load(cls, size: int, work_folder: str):
+        sections = toml.load(config_filepath)
+        config = cls(**{name: SimpleNamespace(**section) for name, section in sections.items()})
+        config.data.lower_bound = 1
+        config.data.upper_bound = size
+        config.local = SimpleNamespace(lower_bound=1, upper_bound=size, start=datetime.now(), data_folder=work_folder,
+                                       data_filepath=os.path.join(work_folder, 'cnumbers.db'))
+        return config
+
+    def add_parameter(self, section: str, key: str, value):
+        if not hasattr(self, section):
+            setattr(self, section, SimpleNamespace())
+        setattr(getattr(self, section), key, value)
+
+
+class BenchmarkContext():
+    '''What a benchmark gets: the range size, a config, a scratch folder and the timer of its measured step'''
+    def __init__(self, size: int, work_folder: str):
+        self.size = size
+        self.work_folder = work_folder
+        self.config = BenchmarkConfig.load(size, work_folder)
+        self.seconds = None
+
+    @contextmanager
+    def measure(self):
+        step_start = time.perf_counter()
+        yield
+        self.seconds = time.perf_counter() - step_start
+
+    def get_data_manager(self) -> DataManager:
+        files = self.config.files
+        return DataManager(self.config.local.data_filepath, bulk_save=files.bulk_save, batch_size=files.save_batch_size,
+                           commit_interval=files.save_commit_interval, path_encoding=files.path_encoding, storage_model=files.storage_model,
+                           successor_limit=self.size, filter_indexes=False)
+
+
+def run_stage_in_process(calculator_class, **parameters):
+    '''Runs a generator stage in the current process and returns what it puts in its queue'''
+    result_queue = queue.Queue()
+    calculator_class(result_queue, **parameters).run()
+    return result_queue.get()
+
+
+def get_tails(size: int, full_path: bool = True) -> tuple:
+    '''Runs the tails stage in the current process; returns the tail columns and the excursion columns (None without full paths)'''
+    tail_columns = TailCalculator.create_columns(2, size)
+    _, excursion_spec = run_stage_in_process(TailCalculator, columns_spec=tail_columns.get_spec(), row_lower=0,
+                                             row_upper=tail_columns.length, limit=size, full_path=full_path)
+    excursion_columns = SharedColumns.attach(excursion_spec) if excursion_spec is not None else None
+    return (tail_columns, excursion_columns)
+
+
+def release_tails(tail_columns: SharedColumns, excursion_columns: SharedColumns):
+    tail_columns.release()
+    if excursion_columns is not None:
+        excursion_columns.release()
+
+
+def get_collection(size: int, full_path: bool = True) -> pd.DataFrame:
+    return VectorizedCalculator(size, full_path=full_path).run()
+
+
+def get_saved_data_manager(context: BenchmarkContext) -> DataManager:
+    data_manager = context.get_data_manager()
+    data_manager.save_data(get_collection(context.size))
+    return data_manager
+
+
+def get_plot_filter() -> dict:
+    return {'name': 'dist_gt_10', 'type': DataManager.FilterType.GTE, 'polarity': False, 'column': 'dist', 'parameters': [10]}
+
+
+def bench_tails(context: BenchmarkContext) -> int:
+    tail_columns = TailCalculator.create_columns(2, context.size)
+    with context.measure():
+        _, excursion_spec = run_stage_in_process(TailCalculator, columns_spec=tail_columns.get_spec(), row_lower=0,
+                                                 row_upper=tail_columns.length, limit=context.size)
+    release_tails(tail_columns, SharedColumns.attach(excursion_spec))
+    return tail_columns.length
+
+
+def bench_collation(context: BenchmarkContext) -> int:
+    tail_columns, excursion_columns = get_tails(context.size)
+    with context.measure():
+        full_paths = resolve_full_paths(tail_columns.arrays, 2, [excursion_columns.arrays['node']])
+    release_tails(tail_columns, excursion_columns)
+    return len(full_paths)
+
+
+def bench_properties(context: BenchmarkContext) -> int:
+    tail_columns, excursion_columns = get_tails(context.size, full_path=False)
+    with context.measure():
+        data, unresolved_count = resolve_properties(tail_columns.arrays, 2)
+    release_tails(tail_columns, excursion_columns)
+    return len(data) - unresolved_count
+
+
+def bench_memoized(context: BenchmarkContext) -> int:
+    with context.measure():
+        data = MemoizedCalculator(context.size, full_path=True).run()
+    return len(data)
+
+
+def bench_vectorized(context: BenchmarkContext) -> int:
+    with context.measure():
+        data = VectorizedCalculator(context.size, full_path=True).run()
+    return len(data)
+
+
+def bench_memoized_no_paths(context: BenchmarkContext) -> int:
+    with context.measure():
+        data = MemoizedCalculator(context.size, full_path=False, memo_limit=WALK_MEMO_LIMIT).run()
+    return len(data)
+
+
+def bench_memoized_jumps(context: BenchmarkContext) -> int:
+    jump_bits = context.config.engine.jump_bits
+    with context.measure():
+        data = MemoizedCalculator(context.size, full_path=False, memo_limit=WALK_MEMO_LIMIT, jump_bits=jump_bits).run()
+    return len(data)
+
+
+def bench_vectorized_no_paths(context: BenchmarkContext) -> int:
+    with context.measure():
+        data = VectorizedCalculator(context.size, full_path=False).run()
+    return len(data)
+
+
+def bench_vectorized_jumps(context: BenchmarkContext) -> int:
+    jump_bits = context.config.engine.jump_bits
+    with context.measure():
+        data = VectorizedCalculator(context.size, full_path=False, jump_bits=jump_bits).run()
+    return len(data)
+
+
+def bench_save(context: BenchmarkContext) -> int:
+    data = get_collection(context.size)
+    data_manager = context.get_data_manager()
+    with context.measure():
+        data_manager.save_data(data)
+    return len(data)
+
+
+def bench_load(context: BenchmarkContext) -> int:
+    data_manager = get_saved_data_manager(context)
+    columns = lab.get_plot_columns(context.config)
+    with context.measure():
+        data = data_manager.load_data(context.config, columns)
+    return len(data)
+
+
+def bench_load_filtered(context: BenchmarkContext) -> int:
+    data_manager = get_saved_data_manager(context)
+    columns = lab.get_plot_columns(context.config)
+    with context.measure():
+        data = data_manager.load_data(context.config, columns, [get_plot_filter()])
+    return len(data)
+
+
+def bench_load_columns(context: BenchmarkContext) -> int:
+    column_store = ColumnStore(os.path.join(context.work_folder, 'cnumbers.columns'))
+    column_store.save_data(get_collection(context.size))
+    columns = lab.get_plot_columns(context.config)
+    with context.measure():
+        data = column_store.load_data(context.config, columns)
+    return len(data)
+
+
+def bench_apply_filter(context: BenchmarkContext) -> int:
+    data_manager = get_saved_data_manager(context)
+    data = data_manager.load_data(context.config, lab.get_plot_columns(context.config))
+    filter = get_plot_filter()
+    with context.measure():
+        data_manager.set_data(data)
+        data_manager.add_filter(filter)
+        data_manager.apply_filter(filter['name'])
+    return len(data)
+
+
+def bench_collection_to_df(context: BenchmarkContext) -> int:
+    data = get_collection(context.size, full_path=False)
+    with context.measure():
+        data = lab.prepare_data(context.config, data, context.size)
+    return len(data)
+
+
+def bench_generate_plot(context: BenchmarkContext) -> int:
+    data = lab.prepare_data(context.config, get_collection(context.size, full_path=False), context.size)
+    html_filepath = os.path.join(context.work_folder, 'main.html')
+    with context.measure():
+        lab.generate_plot(SilentLogger(), context.config, data, 'Benchmark', html_filepath)
+    return len(data)
+
+
+class SilentLogger():
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+BENCHMARKS = {
+    'tails': bench_tails,
+    'collation': bench_collation,
+    'properties': bench_properties,
+    'memoized': bench_memoized,
+    'vectorized': bench_vectorized,
+    'memoized_no_paths': bench_memoized_no_paths,
+    'memoized_jumps': bench_memoized_jumps,
+    'vectorized_no_paths': bench_vectorized_no_paths,
+    'vectorized_jumps': bench_vectorized_jumps,
+    'save': bench_save,
+    'load': bench_load,
+    'load_filtered': bench_load_filtered,
+    'load_columns': bench_load_columns,
+    'apply_filter': bench_apply_filter,
+    'collection_to_df': bench_collection_to_df,
+    'generate_plot': bench_generate_plot,
+}
+
+
+def run_benchmark_process(name: str, size: int, result_queue):
+    '''Runs one benchmark in a scratch folder and reports its time, rows and peak RSS'''
+    work_folder = tempfile.mkdtemp(prefix=f'bench_{name}_')
+    try:
+        context = BenchmarkContext(size, work_folder)
+        rows = BENCHMARKS[name](context)
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        result_queue.put({'status': 'ok', 'seconds': context.seconds, 'rows': rows, 'peak_rss_mb': peak_rss / 1024})
+    except ImportError as e:
+        result_queue.put({'status': 'skipped', 'reason': str(e)})
+    except Exception as e:
+        result_queue.put({'status': 'failed', 'reason': repr(e)})
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+def run_benchmark(name: str, size: int) -> dict:
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_benchmark_process, args=(name, size, result_queue))
+    process.start()
+    try:
+        result = result_queue.get()
+    except KeyboardInterrupt:
+        process.terminate()
+        raise
+    process.join()
+    result.update({'name': name, 'size': size})
+    if result['status'] == 'ok':
+        result['rows_per_second'] = result['rows'] / result['seconds'] if result['seconds'] > 0 else None
+    return result
+
+
+def compare_results(results: list, baseline: dict, threshold: float) -> list:
+    '''Adds the ratio to the baseline to each result; returns the regressions'''
+    baseline_seconds = {(result['name'], result['size']): result['seconds'] for result in baseline['results'] if result['status'] == 'ok'}
+    regressions = []
+    for result in results:
+        key = (result['name'], result['size'])
+        if result['status'] != 'ok' or key not in baseline_seconds:
+            continue
+        result['baseline_seconds'] = baseline_seconds[key]
+        result['ratio'] = result['seconds'] / baseline_seconds[key] if baseline_seconds[key] > 0 else None
+        if result['seconds'] - baseline_seconds[key] > max(threshold * baseline_seconds[key], MIN_SECONDS):
+            result['regression'] = True
+            regressions.append(result)
+    return regressions
+
+
+def format_result(result: dict) -> str:
+    if result['status'] != 'ok':
+        return f'{result["name"]:>16} {result["size"]:>9}  {result["status"]}: {result["reason"]}'
+    line = f'{result["name"]:>16} {result["size"]:>9} {result["seconds"]:>10.4f}s {result["rows_per_second"] or 0:>12.0f} rows/s {result["peak_rss_mb"]:>8.1f} MB'
+    if 'ratio' in result and result['ratio'] is not None:
+        line += f'  x{result["ratio"]:.2f} of baseline'
+    if result.get('regression'):
+        line += '  REGRESSION'
+    return line
+
+
+def get_environment() -> dict:
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the generate and plot stages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='range sizes to benchmark')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run (default: all)')
+    parser.add_argument('--baseline', default=BASELINE_FILEPATH, help='baseline results to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='slowdown ratio flagged as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    arguments = parser.parse_args()
+
+    names = arguments.only or list(BENCHMARKS)
+    results = []
+    for size in arguments.sizes:
+        for name in names:
+            result = run_benchmark(name, size)
+            results.append(result)
+            print(format_result(result), flush=True)
+
+    regressions = []
+    if os.path.isfile(arguments.baseline):
+        with open(arguments.baseline, 'rt') as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), arguments.threshold)
+        print(f'\nCompared with {arguments.baseline} (threshold {arguments.threshold:.0%})')
+        for result in results:
+            if 'ratio' in result:
+                print(format_result(result))
+
+    report = {'environment': get_environment(), 'threshold': arguments.threshold, 'results': results}
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    results_filepath = os.path.join(RESULTS_FOLDER, f'benchmark_{datetime.now().strftime("%d%m%Y_%H%M%S")}.json')
+    with open(results_filepath, 'wt') as results_file:
+        json.dump(report, results_file, indent=4)
+    print(f'\nResults written to {results_filepath}')
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'wt') as baseline_file:
+            json.dump(report, baseline_file, indent=4)
+        print(f'Baseline saved to {arguments.baseline}')
+
+    if len(regressions) > 0:
+        print(f'{len(regressions)} regressions found')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
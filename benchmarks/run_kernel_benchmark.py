@@ -0,0 +1,125 @@
+'''
+Microbenchmark of the integer kernel against the float math it replaced
+
+python -m benchmarks.run_kernel_benchmark                 # 10^6 values, best of 3
+python -m benchmarks.run_kernel_benchmark --size 100000 --repeat 5
+
+Each operation is timed per scalar (a python loop over the values, as in the pipeline stages)
+and on a whole numpy array (as in the memoized and vectorized engines).
+The exactness check lists the values above 2^53 where the float versions are wrong
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+project_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if project_path not in sys.path:
+    sys.path.insert(0, project_path)
+
+from toolbox.int_kernel import floor_log2, get_next, has_odd_parent, is_pow2
+
+
+DEFAULT_SIZE = 1000000
+DEFAULT_REPEAT = 3
+
+
+def float_is_pow2(value) -> bool:
+    log2 = np.log2(value)
+    if log2 % 1 == 0:
+        return True
+    return False
+
+
+def float_get_next(value):
+    if value % 2 == 0:
+        return int(value / 2)
+    return int(value * 3 + 1)
+
+
+def float_floor_log2(value):
+    return int(np.log2(value))
+
+
+def float_has_odd_parent(value):
+    potential = (value - 1) / 3
+    if potential < 0:
+        return False
+    if potential % 1 == 0:
+        if int(potential) % 2 != 0:
+            return True
+    return False
+
+
+def float_array_is_pow2(values):
+    return np.log2(values) % 1 == 0
+
+
+def float_array_floor_log2(values):
+    return np.log2(values).astype(np.int64)
+
+
+def float_array_has_odd_parent(values):
+    potential = (values - 1) / 3
+    return (potential % 1 == 0) & (potential.astype(np.int64) % 2 != 0)
+
+
+# name: (float scalar, kernel scalar, float array, kernel array)
+OPERATIONS = {
+    'is_pow2': (float_is_pow2, is_pow2, float_array_is_pow2, is_pow2),
+    'get_next': (float_get_next, get_next, None, get_next),
+    'floor_log2': (float_floor_log2, floor_log2, float_array_floor_log2, floor_log2),
+    'has_odd_parent': (float_has_odd_parent, has_odd_parent, float_array_has_odd_parent, has_odd_parent),
+}
+
+
+def time_best(function, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def get_exactness_errors() -> dict:
+    '''The values around the powers of 2 above 2^53 where the float versions differ from the exact result'''
+    values = [2**power + offset for power in range(53, 63) for offset in [-1, 1]]
+    errors = {}
+    for name, (float_scalar, kernel_scalar, _, _) in OPERATIONS.items():
+        wrong = [value for value in values if float_scalar(value) != kernel_scalar(value)]
+        errors[name] = len(wrong)
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Integer kernel vs float math microbenchmark')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='number of values')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per timing, the best is kept')
+    args = parser.parse_args()
+
+    scalars = list(range(1, args.size + 1))
+    values = np.arange(1, args.size + 1, dtype=np.int64)
+    print(f'{args.size} values, best of {args.repeat}')
+    print(f'{"operation":<16}{"kind":<8}{"float s":>10}{"kernel s":>10}{"speedup":>10}')
+    for name, (float_scalar, kernel_scalar, float_array, kernel_array) in OPERATIONS.items():
+        float_seconds = time_best(lambda: [float_scalar(value) for value in scalars], args.repeat)
+        kernel_seconds = time_best(lambda: [kernel_scalar(value) for value in scalars], args.repeat)
+        print(f'{name:<16}{"scalar":<8}{float_seconds:>10.4f}{kernel_seconds:>10.4f}{float_seconds / kernel_seconds:>9.1f}x')
+        kernel_seconds = time_best(lambda: kernel_array(values), args.repeat)
+        if float_array is None:
+            print(f'{name:<16}{"array":<8}{"-":>10}{kernel_seconds:>10.4f}{"-":>10}')
+            continue
+        float_seconds = time_best(lambda: float_array(values), args.repeat)
+        print(f'{name:<16}{"array":<8}{float_seconds:>10.4f}{kernel_seconds:>10.4f}{float_seconds / kernel_seconds:>9.1f}x')
+
+    print('Values around 2^53..2^62 where the float version is wrong:')
+    for name, error_count in get_exactness_errors().items():
+        print(f'* {name}: {error_count} of 20')
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,12 @@ from datetime import datetime
 from pytoolbox.config_agent import ConfigAgent
 
 import toolbox.logger_agent as logger_agent
+from agents.converter import run as run_converter
 from agents.generator import run as run_generator
+from agents.migrator import run as run_migrator
 from agents.plotter import run as run_plotter
+from agents.tiler import run as run_tiler
+from agents.viewer import run as run_viewer
 from toolbox import (
     get_config_filepath,
     get_data_folder,
@@ -14,6 +18,7 @@ from toolbox import (
     get_output_folder,
     get_stash_folder,
 )
+from toolbox.column_store import ColumnStore, get_column_store_folder
 from toolbox.data_manager import DataManager
 
 
@@ -33,7 +38,16 @@ output_folder = get_output_folder()
 lower_bound = config.data.lower_bound
 upper_bound = config.data.upper_bound
 data_filepath = os.path.join(data_folder, config.files.data_file_name)
-data_manager = DataManager(data_filepath)
+data_manager_class = ColumnStore if config.files.backend == 'columns' else DataManager
+data_store_path = get_column_store_folder(data_filepath) if config.files.backend == 'columns' else data_filepath
+data_manager = data_manager_class(data_store_path,
+                                  bulk_save=config.files.bulk_save,
+                                  batch_size=config.files.save_batch_size,
+                                  commit_interval=config.files.save_commit_interval,
+                                  path_encoding=config.files.path_encoding,
+                                  storage_model=config.files.storage_model,
+                                  successor_limit=upper_bound,
+                                  filter_indexes=config.files.filter_indexes)
 
 
 def main():
@@ -55,6 +69,14 @@ def main():
             run_plotter(logger, config, data_manager)
         elif mode == 'generate':
             run_generator(logger, config, data_manager)
+        elif mode == 'migrate':
+            run_migrator(logger, config, data_manager)
+        elif mode == 'convert':
+            run_converter(logger, config, data_manager)
+        elif mode == 'tiles':
+            run_tiler(logger, config, data_manager)
+        elif mode == 'view':
+            run_viewer(logger, config, data_manager)
         else:
             print(f'Run mode {mode} is not supported')
             sys.exit(1)
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip('bokeh')
+pytest.importorskip('pytoolbox.bokeh_agent')
+
+import toolbox.lab as lab
+from benchmarks.run_benchmarks import BenchmarkConfig, SilentLogger
+from toolbox.generators import VectorizedCalculator
+
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize('webgl, output_backend', [(True, 'webgl'), (False, 'canvas')])
+def test_generate_plot_output_backend(tmp_path, webgl, output_backend):
+    config = BenchmarkConfig.load(SIZE, str(tmp_path))
+    config.plot.webgl = webgl
+    data = lab.prepare_data(config, VectorizedCalculator(limit=SIZE, full_path=False).run(), SIZE)
+    plot = lab.generate_plot(SilentLogger(), config, data, 'Test', str(tmp_path / 'main.html'))
+
+    assert plot.figure.output_backend == output_backend
@@ -0,0 +1,377 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from toolbox.data_manager import PROGRESS_COLUMNS, CNumber, DataManager, get_value_intervals
+from toolbox.metrics import RunMetrics, measured
+from toolbox.path_codec import calculate_path, decode_path, encode_path, parse_path_string
+
+
+'''
+A DataManager backend keeping each CNumber column as a fixed width .npy file, indexed directly by value
+
+<column store folder>/<column>.npy - one row per value, from 0 to the capacity of the store
+<column store folder>/paths.bin - parity bit blobs of the paths (see path_codec), addressed by path_offset and path_length
+<column store folder>/progress.csv - value blocks committed by streamed generate runs (see DataManager.add_progress)
+
+A range load is a slice of the memory mapped columns, so a fully stored, unfiltered range is loaded without copying.
+Paths are always kept as parity bits, whatever the path_encoding
+'''
+
+COLUMN_STORE_SUFFIX = '.columns'
+
+
+def get_column_store_folder(db_filepath: str) -> str:
+    '''The column store of a db file is kept next to it, in a folder with the same name'''
+    return os.path.splitext(db_filepath)[0] + COLUMN_STORE_SUFFIX
+
+
+class ColumnStore(DataManager):
+    '''Governs the persistence and filtering of data, stored in memory mapped columns'''
+    COLUMNS = {
+        'present': np.bool_,
+        'is_bb': np.bool_,
+        'dist': np.int32,
+        'dist_to_bb': np.int32,
+        'closest_vert_value': np.int64,
+        'closest_vert': np.int32,
+        'peak': np.int64,
+        'peak_slope': np.float64,
+        'odd_parent': np.bool_,
+        'path_offset': np.int64,
+        'path_length': np.int32,
+    }
+    PATHS_FILENAME = 'paths.bin'
+    PROGRESS_FILENAME = 'progress.csv'
+    MIN_CAPACITY = 1024
+
+    def __init__(self, folder, bulk_save=False, batch_size=50000, commit_interval=500000, path_encoding='string',
+                 storage_model='paths', successor_limit=0, suffix_cache_size=4096, filter_indexes=True):
+        # the folder stands in for the db file, e.g. for the DataWriter
+        self.db_filepath = folder
+        self.folder = folder
+        self.filters = []
+        self.save_options = {'bulk_save': bulk_save, 'batch_size': batch_size, 'commit_interval': commit_interval, 'path_encoding': path_encoding,
+                             'storage_model': storage_model, 'successor_limit': successor_limit}
+        self.metrics = RunMetrics()
+        os.makedirs(folder, exist_ok=True)
+
+
+    def get_column_filepath(self, column: str) -> str:
+        return os.path.join(self.folder, f'{column}.npy')
+
+
+    def get_capacity(self) -> int:
+        '''Number of value rows in the column files'''
+        filepath = self.get_column_filepath('present')
+        if not os.path.isfile(filepath):
+            return 0
+        return len(np.load(filepath, mmap_mode='r'))
+
+
+    def open_column(self, column: str, mode: str = 'r') -> np.ndarray:
+        '''Memory maps a column file; an empty column if the store holds no data yet'''
+        if not os.path.isfile(self.get_column_filepath(column)):
+            return np.zeros(0, dtype=self.COLUMNS[column])
+        return np.load(self.get_column_filepath(column), mmap_mode=mode)
+
+
+    def ensure_capacity(self, capacity: int):
+        '''Grows all column files to hold at least capacity rows, doubling the current size'''
+        current_capacity = self.get_capacity()
+        if capacity <= current_capacity:
+            return
+        new_capacity = max(capacity, 2 * current_capacity, self.MIN_CAPACITY)
+        for column, dtype in self.COLUMNS.items():
+            filepath = self.get_column_filepath(column)
+            temporary_filepath = filepath + '.tmp'
+            grown = np.lib.format.open_memmap(temporary_filepath, mode='w+', dtype=dtype, shape=(new_capacity,))
+            if column == 'path_offset':
+                grown[current_capacity:] = -1
+            if current_capacity > 0:
+                grown[:current_capacity] = self.open_column(column)
+            grown.flush()
+            del grown
+            os.replace(temporary_filepath, filepath)
+
+
+    @measured('ColumnStore.save_data')
+    def save_data(self, data: pd.DataFrame):
+        '''Writes the data in the rows of its values, existing values are overwritten'''
+        if len(data) == 0:
+            return
+        values = data['value'].to_numpy(dtype=np.int64)
+        self.ensure_capacity(int(values.max()) + 1)
+        for column in self.COLUMNS:
+            if column in data and column not in ['present', 'path_offset', 'path_length']:
+                stored_column = self.open_column(column, 'r+')
+                stored_column[values] = data[column].to_numpy()
+                stored_column.flush()
+        self.save_paths(data)
+        present = self.open_column('present', 'r+')
+        present[values] = True
+        present.flush()
+
+
+    def save_paths(self, data: pd.DataFrame):
+        '''Appends the encoded paths to the paths file and points the rows of their values to them'''
+        values = data['value'].tolist()
+        if 'path_bits' not in data and ('full_path' not in data or self.get_path_encoding() is None):
+            return
+        # paths come either encoded (e.g. converted from a db) or as lists of values (from the generator)
+        path_bits = data['path_bits'].tolist() if 'path_bits' in data else [None] * len(values)
+        full_paths = data['full_path'].tolist() if 'full_path' in data else [None] * len(values)
+        blobs = []
+        for value, blob, path in zip(values, path_bits, full_paths):
+            if blob is None and path is not None:
+                if isinstance(path, str):
+                    path = parse_path_string(path).tolist()
+                blob = encode_path(value, path)
+            blobs.append(blob)
+
+        paths_filepath = os.path.join(self.folder, self.PATHS_FILENAME)
+        offset = os.path.getsize(paths_filepath) if os.path.isfile(paths_filepath) else 0
+        offsets = np.full(len(values), -1, dtype=np.int64)
+        lengths = np.zeros(len(values), dtype=np.int32)
+        with open(paths_filepath, 'ab') as paths_file:
+            for row, blob in enumerate(blobs):
+                if blob is None:
+                    continue
+                paths_file.write(blob)
+                offsets[row] = offset
+                lengths[row] = len(blob)
+                offset += len(blob)
+        path_offset = self.open_column('path_offset', 'r+')
+        path_length = self.open_column('path_length', 'r+')
+        path_offset[values] = offsets
+        path_length[values] = lengths
+        path_offset.flush()
+        path_length.flush()
+
+
+    @measured('ColumnStore.load_data')
+    def load_data(self, config, columns: list = None, filters: list = None):
+        '''
+        Loads data, clamped with lowerbound and upperbound
+
+        Same as DataManager.load_data; the filters are applied as masks on the columns
+        '''
+        lowerbound = config.local.lower_bound
+        upperbound = config.local.upper_bound
+        if columns is None:
+            columns = [column.name for column in CNumber.__table__.columns]
+        missing_columns = set(columns) - set(column.name for column in CNumber.__table__.columns)
+        if len(missing_columns) > 0:
+            raise ValueError(f'The db does not contain the columns: {", ".join(sorted(missing_columns))}')
+        for filter in filters or []:
+            self._validate_filter(filter)
+        return self.select_range(lowerbound + 1, upperbound + 1, columns, filters or [], upperbound)
+
+
+    @measured('ColumnStore.load_range')
+    def load_range(self, lower: int, upper: int, columns: list) -> pd.DataFrame:
+        '''Loads the given columns of the numbers stored in [lower, upper), in value order'''
+        return self.select_range(lower, upper, columns)
+
+
+    @measured('ColumnStore.load_properties')
+    def load_properties(self, lower: int, upper: int) -> pd.DataFrame:
+        '''Loads the properties needed to continue the calculation from the numbers stored in [lower, upper)'''
+        data = self.select_range(lower, upper, ['value', 'dist', 'dist_to_bb', 'closest_vert_value', 'peak'])
+        return data.astype(np.int64)
+
+
+    def select_range(self, lower: int, upper: int, columns: list, filters: list = None, limit: int = 0) -> pd.DataFrame:
+        '''
+        Slices the columns for the stored values in [lower, upper) that pass the filters
+
+        The slices share the memory of the column files when all the values are stored and nothing is filtered out
+        '''
+        lower = max(lower, 0)
+        upper = max(min(upper, self.get_capacity()), lower)
+        mask = np.array(self.open_column('present')[lower:upper])
+        for filter in filters or []:
+            mask &= self.get_filter_mask(filter, lower, upper, limit)
+        rows = None if mask.all() else np.flatnonzero(mask)
+
+        data = {}
+        for column in columns:
+            if column == 'value':
+                values = np.arange(lower, upper, dtype=np.int64)
+            elif column in ['full_path', 'path_bits']:
+                data[column] = self.get_path_column(column, lower, upper, rows)
+                continue
+            else:
+                values = self.open_column(column)[lower:upper]
+            data[column] = values if rows is None else values[rows]
+
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+
+    def get_filter_mask(self, filter: dict, lower: int, upper: int, limit: int) -> np.ndarray:
+        '''Evaluates a filter on the rows of [lower, upper), same as DataManager.apply_filter'''
+        parameters = filter['parameters']
+        if filter['column'] == 'bounded':
+            # the derived plot column, calculated against the upper bound
+            is_bounded = self.open_column('peak')[lower:upper] <= limit
+            flags = [str(parameter) for parameter in parameters]
+            if filter['type'] == self.FilterType.EQL:
+                flags = flags[:1]
+            elif filter['type'] != self.FilterType.LST:
+                raise ValueError('The "bounded" column can only be filtered by EQL or LST')
+            mask = np.zeros(upper - lower, dtype=bool)
+            if 'True' in flags:
+                mask |= is_bounded
+            if 'False' in flags:
+                mask |= ~is_bounded
+        else:
+            if filter['column'] == 'value':
+                column = np.arange(lower, upper, dtype=np.int64)
+            elif filter['column'] in self.COLUMNS and filter['column'] not in ['present', 'path_offset', 'path_length']:
+                column = self.open_column(filter['column'])[lower:upper]
+            else:
+                raise ValueError(f'The data does not contain a column named "{filter["column"]}"')
+            if filter['type'] == self.FilterType.LTE:
+                mask = column <= parameters[0]
+            elif filter['type'] == self.FilterType.GTE:
+                mask = column >= parameters[0]
+            elif filter['type'] == self.FilterType.RNG:
+                mask = (column >= parameters[0]) & (column <= parameters[1])
+            elif filter['type'] == self.FilterType.LST:
+                mask = np.isin(column, parameters)
+            elif filter['type'] == self.FilterType.EQL:
+                mask = column == parameters[0]
+
+        return mask if filter['polarity'] else ~mask
+
+
+    def get_path_column(self, column: str, lower: int, upper: int, rows) -> list:
+        '''Reads the path blobs of the rows; decoded into path strings for the full_path column'''
+        offsets = self.open_column('path_offset')[lower:upper]
+        lengths = self.open_column('path_length')[lower:upper]
+        row_indexes = range(upper - lower) if rows is None else rows.tolist()
+        paths_filepath = os.path.join(self.folder, self.PATHS_FILENAME)
+        if not os.path.isfile(paths_filepath):
+            return [None] * len(row_indexes)
+        paths = []
+        with open(paths_filepath, 'rb') as paths_file:
+            for row in row_indexes:
+                if offsets[row] < 0:
+                    paths.append(None)
+                    continue
+                paths_file.seek(offsets[row])
+                blob = paths_file.read(lengths[row])
+                if column == 'full_path':
+                    paths.append(CNumber.compile_path_string(decode_path(lower + row, blob).tolist()))
+                else:
+                    paths.append(blob)
+        return paths
+
+
+    def get_path(self, value: int) -> np.ndarray:
+        '''Rebuilds the full path of a stored number; numbers stored without a path are iterated'''
+        if value >= self.get_capacity() or not self.open_column('present')[value]:
+            raise ValueError(f'The number {value} is not in the db')
+        blob = self.get_path_column('path_bits', value, value + 1, None)[0]
+        if blob is None:
+            return calculate_path(value)
+        return decode_path(value, blob)
+
+
+    @measured('ColumnStore.get_missing_ranges')
+    def get_missing_ranges(self, lower: int, upper: int) -> list:
+        '''
+        Finds the values in [lower, upper) that are not in the store
+
+        Returns
+        ------
+        list
+            (lower, upper) tuples of the missing ranges, upper exclusive
+        '''
+        if lower >= upper:
+            return []
+        stored_upper = max(min(upper, self.get_capacity()), lower)
+        missing = ~np.array(self.open_column('present')[lower:stored_upper])
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], missing.astype(np.int8), [0]))))
+        missing_ranges = [(int(start) + lower, int(end) + lower) for start, end in zip(edges[::2], edges[1::2])]
+        if stored_upper < upper:
+            if len(missing_ranges) > 0 and missing_ranges[-1][1] == stored_upper:
+                missing_ranges[-1] = (missing_ranges[-1][0], upper)
+            else:
+                missing_ranges.append((stored_upper, upper))
+        return missing_ranges
+
+
+    def get_coverage(self):
+        '''The value intervals [lower, upper) held in the store; None if it is empty'''
+        intervals = get_value_intervals(np.flatnonzero(self.open_column('present')))
+        return intervals if len(intervals) > 0 else None
+
+
+    def add_coverage(self, intervals: list):
+        '''The present column is the coverage record of the store'''
+        return
+
+
+    def rebuild_coverage(self) -> list:
+        return self.get_coverage() or []
+
+
+    def add_progress(self, block: dict):
+        '''Records a committed block of values, as a line of the progress file'''
+        progress_filepath = os.path.join(self.folder, self.PROGRESS_FILENAME)
+        block_df = pd.DataFrame([block], columns=PROGRESS_COLUMNS)
+        block_df.to_csv(progress_filepath, mode='a', header=not os.path.isfile(progress_filepath), index=False)
+
+
+    def get_progress(self) -> pd.DataFrame:
+        '''The recorded blocks, ordered by value, the latest record of each block'''
+        progress_filepath = os.path.join(self.folder, self.PROGRESS_FILENAME)
+        if not os.path.isfile(progress_filepath):
+            return pd.DataFrame(columns=PROGRESS_COLUMNS)
+        progress = pd.read_csv(progress_filepath)
+        return progress.drop_duplicates('lower', keep='last').sort_values('lower').reset_index(drop=True)
+
+
+    def migrate_paths(self, batch_size=50000) -> int:
+        '''
+        Compacts the paths file, dropping the blobs of overwritten paths
+
+        Returns
+        ------
+        int
+            number of kept paths
+        '''
+        paths_filepath = os.path.join(self.folder, self.PATHS_FILENAME)
+        if not os.path.isfile(paths_filepath):
+            return 0
+        path_offset = self.open_column('path_offset', 'r+')
+        path_length = self.open_column('path_length', 'r+')
+        values = np.flatnonzero(path_offset >= 0)
+        temporary_filepath = paths_filepath + '.tmp'
+        offset = 0
+        with open(paths_filepath, 'rb') as paths_file, open(temporary_filepath, 'wb') as compacted_file:
+            for batch_start in range(0, len(values), batch_size):
+                batch = values[batch_start:batch_start + batch_size]
+                for value in batch.tolist():
+                    paths_file.seek(path_offset[value])
+                    compacted_file.write(paths_file.read(path_length[value]))
+                    path_offset[value] = offset
+                    offset += int(path_length[value])
+        os.replace(temporary_filepath, paths_filepath)
+        path_offset.flush()
+        return len(values)
+
+
+    def get_db_size(self) -> int:
+        '''Size of the column and paths files in bytes'''
+        return sum(os.path.getsize(os.path.join(self.folder, filename)) for filename in os.listdir(self.folder))
+
+
+    def get_value_bounds(self) -> tuple:
+        '''The lowest stored value and the value above the highest one; None if the store is empty'''
+        coverage = self.get_coverage()
+        if coverage is None:
+            return None
+        return (coverage[0][0], coverage[-1][1])
@@ -1,11 +1,21 @@
+import os
+import signal
+import time
+from collections import OrderedDict
 from enum import Enum, auto
-from sqlalchemy import create_engine, Column, Integer, Boolean, Float, String
+from multiprocessing import Process, Queue
+from queue import Full
+from sqlalchemy import create_engine, false, inspect, insert, not_, or_, select, Column, Integer, Boolean, Float, String, LargeBinary
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import declarative_base
 from progress.bar import Bar
 
+import numpy as np
 import pandas as pd
 
+from toolbox.metrics import RunMetrics, measured
+from toolbox.path_codec import calculate_path, decode_path, encode_path, get_successor, get_successor_steps, parse_path_string
+
 Base = declarative_base()
 
 
@@ -25,6 +35,9 @@ RNG = auto() within range (inclusive); polarity changes to outside of range (exc
 LST = auto() in a list; polarity changes to not in a list
 EQL = auto() equals; polarity changes to not equals
 
+Filters passed to load_data are compiled into the WHERE clause of the query when possible,
+the derived 'bounded' column is rewritten as peak <= upper bound, other filters are applied in memory
+
 alternative filtering at 
 # LINK https://www.peterspython.com/en/blog/slqalchemy-dynamic-query-building-and-filtering-including-soft-deletes
 '''
@@ -43,13 +56,21 @@ class CNumber(Base):
     peak = Column("peak", Integer)
     peak_slope = Column("peak_slope", Float)
     odd_parent = Column("odd_parent", Boolean)
+    path_bits = Column("path_bits", LargeBinary)
 
-# ,value,is_bb,full_path,dist,dist_to_bb,closest_vert_value,closest_vert,peak,peak_slope,odd_parent
+# ,value,is_bb,full_path,dist,dist_to_bb,closest_vert_value,closest_vert,peak,peak_slope,odd_parent,path_bits
 
-    def __init__(self, number_dict):
+    def __init__(self, number_dict, path_encoding='string'):
         self.value = number_dict['value']
         self.is_bb = number_dict['is_bb']
-        self.full_path = self.compile_path_string(number_dict['full_path'])
+        full_path = number_dict.get('full_path')
+        self.full_path = None
+        self.path_bits = None
+        if full_path is not None and path_encoding is not None:
+            if path_encoding == 'bits':
+                self.path_bits = encode_path(self.value, full_path)
+            else:
+                self.full_path = self.compile_path_string(full_path)
         self.dist = number_dict['dist']
         self.dist_to_bb = number_dict['dist_to_bb']
         self.closest_vert_value = number_dict['closest_vert_value']
@@ -58,11 +79,92 @@ class CNumber(Base):
         self.peak_slope = number_dict['peak_slope']
         self.odd_parent = number_dict['odd_parent']
 
-    def compile_path_string(self, path_list: list) -> str:
+    @staticmethod
+    def compile_path_string(path_list: list) -> str:
         path_string = ",".join([str(value) for value in path_list])
         return path_string
 
 
+class CSuccessor(Base):
+    '''
+    Successor pointer storage model: the next node of a number's path that is below the successor limit
+
+    Only what can not be derived is stored: a path that stays below the limit has the next value of the iteration
+    as its successor, so its row is empty; for a path that leaves the range, the steps up to the successor
+    are stored as parity bits (excursion_bits, see path_codec), which the successor is the last node of.
+    The successor and excursion (string) columns are filled only in dbs written by earlier versions
+    '''
+    __tablename__ = "csuccessors"
+    value = Column("value", Integer, primary_key=True)
+    successor = Column("successor", Integer)
+    excursion = Column("excursion", String)
+    excursion_bits = Column("excursion_bits", LargeBinary)
+
+
+class CCoverage(Base):
+    '''Value intervals [lower, upper) stored in the cnumbers table, kept merged by DataManager'''
+    __tablename__ = "ccoverage"
+    lower = Column("lower", Integer, primary_key=True)
+    upper = Column("upper", Integer)
+
+
+class CProgress(Base):
+    '''
+    Value blocks [lower, upper) committed by streamed generate runs, with their timing
+
+    A block is recorded once its data is committed, so an interrupted run can be resumed from the recorded blocks
+    '''
+    __tablename__ = "cprogress"
+    lower = Column("lower", Integer, primary_key=True)
+    upper = Column("upper", Integer)
+    rows = Column("rows", Integer)
+    calculate_seconds = Column("calculate_seconds", Float)
+    save_seconds = Column("save_seconds", Float)
+    run_start = Column("run_start", String)
+
+
+PROGRESS_COLUMNS = ['lower', 'upper', 'rows', 'calculate_seconds', 'save_seconds', 'run_start']
+
+
+def get_value_intervals(values) -> list:
+    '''Splits a collection of values into intervals [lower, upper) of consecutive values'''
+    values = np.unique(np.asarray(values, dtype=np.int64))
+    if len(values) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(values) > 1)
+    lowers = np.concatenate(([values[0]], values[breaks + 1]))
+    uppers = np.concatenate((values[breaks] + 1, [values[-1] + 1]))
+    return [(int(lower), int(upper)) for lower, upper in zip(lowers, uppers)]
+
+
+def merge_intervals(intervals: list) -> list:
+    '''Merges overlapping and adjacent intervals [lower, upper)'''
+    merged = []
+    for lower, upper in sorted(intervals):
+        if len(merged) > 0 and lower <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], upper))
+        else:
+            merged.append((lower, upper))
+    return merged
+
+
+def subtract_intervals(lower: int, upper: int, intervals: list) -> list:
+    '''The parts of [lower, upper) not covered by the merged intervals'''
+    missing = []
+    position = lower
+    for interval_lower, interval_upper in intervals:
+        if interval_upper <= position:
+            continue
+        if interval_lower >= upper:
+            break
+        if interval_lower > position:
+            missing.append((position, interval_lower))
+        position = max(position, interval_upper)
+    if position < upper:
+        missing.append((position, upper))
+    return missing
+
+
 class DataManager():
     '''Governs the persistence and filtering of data'''
     class FilterType(Enum):
@@ -72,44 +174,513 @@ class DataManager():
         LST = auto()
         EQL = auto()
 
+    # commonly filtered columns, indexed on the first filtered load
+    INDEXED_COLUMNS = ['dist', 'dist_to_bb', 'closest_vert', 'peak', 'odd_parent']
+    # a bulk save of at least this share of the stored rows rebuilds the filter indexes instead of updating them row by row
+    INDEX_REBUILD_SHARE = 0.25
+
 
-    def __init__(self, db_filepath):
+    def __init__(self, db_filepath, bulk_save=False, batch_size=50000, commit_interval=500000, path_encoding='string',
+                 storage_model='paths', successor_limit=0, suffix_cache_size=4096, filter_indexes=True):
+        self.db_filepath = db_filepath
         self.engine = create_engine(f"sqlite:///{db_filepath}")
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
         self.filters = []
+        self.save_options = {'bulk_save': bulk_save, 'batch_size': batch_size, 'commit_interval': commit_interval, 'path_encoding': path_encoding,
+                             'storage_model': storage_model, 'successor_limit': successor_limit}
+        self.suffix_cache = OrderedDict()
+        self.suffix_cache_size = suffix_cache_size
+        self.successors_present = None
+        self.filter_indexes = filter_indexes
+        self.metrics = RunMetrics()
+        self._upgrade_schema()
+
+
+    def get_path_encoding(self):
+        '''The encoding of the paths saved in the cnumbers table; None if paths are not saved there'''
+        if self.save_options['storage_model'] == 'successor':
+            return None
+        return self.save_options['path_encoding']
+
+
+    def _upgrade_schema(self):
+        '''Adds the columns missing from dbs created by earlier versions'''
+        inspector = inspect(self.engine)
+        with self.engine.connect() as connection:
+            for table in [CNumber.__table__, CSuccessor.__table__]:
+                if not inspector.has_table(table.name):
+                    continue
+                existing_columns = [column['name'] for column in inspector.get_columns(table.name)]
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            connection.commit()
 
 
     def data_already_exists(self, config):
         lower_bound = config.local.lower_bound
-        upper_bound = config.local.upper_bound - 1
-        if len(self.load_data(config)) < upper_bound - lower_bound:
-            return False
-        return True
+        upper_bound = config.local.upper_bound
+        return len(self.get_missing_ranges(lower_bound + 1, upper_bound)) == 0
+
+
+    def get_coverage(self):
+        '''
+        The merged value intervals [lower, upper) stored in the db
+
+        Returns
+        ------
+        list
+            (lower, upper) tuples; None if the db has no coverage records (e.g. created by an earlier version)
+        '''
+        inspector = inspect(self.engine)
+        if not inspector.has_table(CCoverage.__tablename__):
+            return None
+        intervals = self._fetch_raw(f'SELECT lower, upper FROM {CCoverage.__tablename__} ORDER BY lower', ())
+        if len(intervals) == 0:
+            return None
+        return [tuple(interval) for interval in intervals]
+
+
+    def add_coverage(self, intervals: list):
+        '''Records newly stored value intervals, merged with the existing ones'''
+        if len(intervals) == 0:
+            return
+        Base.metadata.create_all(bind=self.engine)
+        existing = self.get_coverage()
+        if existing is None:
+            # a db from an earlier version has values but no records of them
+            existing = self.rebuild_coverage()
+        merged = merge_intervals(existing + intervals)
+        with self.engine.connect() as connection:
+            connection.exec_driver_sql(f'DELETE FROM {CCoverage.__tablename__}')
+            connection.exec_driver_sql(f'INSERT INTO {CCoverage.__tablename__} (lower, upper) VALUES (?, ?)', merged)
+            connection.commit()
+
+
+    def rebuild_coverage(self) -> list:
+        '''Rebuilds the coverage records from the stored values, for dbs created by earlier versions'''
+        if not inspect(self.engine).has_table(CNumber.__tablename__):
+            return []
+        rows = self._fetch_raw(f'SELECT value FROM {CNumber.__tablename__} ORDER BY value', ())
+        intervals = get_value_intervals([row[0] for row in rows])
+        Base.metadata.create_all(bind=self.engine)
+        with self.engine.connect() as connection:
+            connection.exec_driver_sql(f'DELETE FROM {CCoverage.__tablename__}')
+            if len(intervals) > 0:
+                connection.exec_driver_sql(f'INSERT INTO {CCoverage.__tablename__} (lower, upper) VALUES (?, ?)', intervals)
+            connection.commit()
+        return intervals
+
+
+    def add_progress(self, block: dict):
+        '''
+        Records a committed block of values
+
+        Params
+        ------
+        block: dict
+            lower, upper, rows, calculate_seconds, save_seconds and run_start of the block (see PROGRESS_COLUMNS)
+        '''
+        Base.metadata.create_all(bind=self.engine)
+        statement = str(insert(CProgress.__table__).prefix_with('OR REPLACE').compile(dialect=self.engine.dialect))
+        with self.engine.connect() as connection:
+            connection.exec_driver_sql(statement, tuple(block[column] for column in PROGRESS_COLUMNS))
+            connection.commit()
+
+
+    def get_progress(self) -> pd.DataFrame:
+        '''The recorded blocks, ordered by value; empty if no streamed run committed any'''
+        if not inspect(self.engine).has_table(CProgress.__tablename__):
+            return pd.DataFrame(columns=PROGRESS_COLUMNS)
+        rows = self._fetch_raw(f'SELECT {", ".join(PROGRESS_COLUMNS)} FROM {CProgress.__tablename__} ORDER BY lower', ())
+        return pd.DataFrame([tuple(row) for row in rows], columns=PROGRESS_COLUMNS)
 
 
+    @measured('DataManager.save_data')
     def save_data(self, data: pd.DataFrame):
         '''Saves the data via sqlalchemy'''
         Base.metadata.create_all(bind=self.engine)
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        data_list = data.to_dict(orient="records")
-        with Bar('Adding records to db', max=len(data_list)) as bar:
-            for record in data_list:
-                test_cnumber = CNumber(record)
-                session.merge(test_cnumber)
-                bar.next()        
-        session.commit()
-        
-
-    def load_data(self, config):
-        '''Loads data, clamped with lowerbound and upperbound'''
+        if self.save_options['storage_model'] == 'successor':
+            self.save_successors(data['value'].tolist())
+        if self.save_options['bulk_save']:
+            self.save_data_bulk(data)
+        else:
+            Session = sessionmaker(bind=self.engine)
+            session = Session()
+            data_list = data.to_dict(orient="records")
+            path_encoding = self.get_path_encoding()
+            with Bar('Adding records to db', max=len(data_list)) as bar:
+                for record in data_list:
+                    test_cnumber = CNumber(record, path_encoding=path_encoding)
+                    session.merge(test_cnumber)
+                    bar.next()
+            session.commit()
+        self.add_coverage(get_value_intervals(data['value']))
+
+
+    def save_successors(self, values: list):
+        '''
+        Saves the successor pointers of the values, instead of their full paths
+
+        The successor is the next node of the path below successor_limit; for the paths
+        that leave the range, the steps up to the successor are saved as parity bits (see CSuccessor)
+        '''
+        limit = self.save_options['successor_limit']
+        if limit < 2:
+            raise ValueError('The successor storage model needs a successor limit of at least 2')
+        batch_size = self.save_options['batch_size']
+        statement = str(insert(CSuccessor.__table__).prefix_with('OR REPLACE').compile(dialect=self.engine.dialect))
+        with self.engine.connect() as connection:
+            for batch_start in range(0, len(values), batch_size):
+                batch = []
+                for value in values[batch_start:batch_start + batch_size]:
+                    successor, excursion = get_successor(value, limit)
+                    excursion_bits = encode_path(value, excursion + [successor]) if len(excursion) > 0 else None
+                    batch.append((value, None, None, excursion_bits))
+                connection.exec_driver_sql(statement, batch)
+            connection.commit()
+
+
+    def save_data_bulk(self, data: pd.DataFrame):
+        '''
+        Saves the data with batched INSERT OR REPLACE statements
+
+        Existing values are overwritten, same as with save_data.
+        The rows are sent in batches of batch_size and committed every commit_interval rows.
+        When the rows are at least INDEX_REBUILD_SHARE of the stored rows, the existing filter indexes are dropped
+        before the save and recreated after it; if the save fails, they are recreated by the next filtered load
+        '''
+        batch_size = self.save_options['batch_size']
+        commit_interval = self.save_options['commit_interval']
+        path_encoding = self.get_path_encoding()
+        encode_bits = path_encoding == 'bits'
+        table = CNumber.__table__
+        column_names = [column.name for column in table.columns]
+        statement = str(insert(table).prefix_with('OR REPLACE').compile(dialect=self.engine.dialect))
+        columns = []
+        for column_name in column_names:
+            if column_name == 'full_path' and 'full_path' in data and path_encoding == 'string':
+                columns.append([CNumber.compile_path_string(path) if path is not None else None for path in data['full_path']])
+            elif column_name == 'path_bits' and 'full_path' in data and encode_bits:
+                columns.append([encode_path(value, path) if path is not None else None for value, path in zip(data['value'].tolist(), data['full_path'])])
+            elif column_name not in data or column_name == 'full_path':
+                columns.append([None] * len(data))
+            else:
+                columns.append(data[column_name].tolist())
+
+        rebuilt_indexes = self.get_indexed_columns()
+        if len(rebuilt_indexes) > 0:
+            stored_count = sum(upper - lower for lower, upper in self.get_coverage() or [])
+            if len(data) < self.INDEX_REBUILD_SHARE * stored_count:
+                rebuilt_indexes = []
+        if len(rebuilt_indexes) > 0:
+            self.drop_indexes(rebuilt_indexes)
+
+        uncommitted = 0
+        with self.engine.connect() as connection:
+            with Bar('Adding records to db', max=len(data)) as bar:
+                for batch_start in range(0, len(data), batch_size):
+                    batch = list(zip(*[column[batch_start:batch_start + batch_size] for column in columns]))
+                    connection.exec_driver_sql(statement, batch)
+                    uncommitted += len(batch)
+                    if uncommitted >= commit_interval:
+                        connection.commit()
+                        uncommitted = 0
+                    bar.next(len(batch))
+            connection.commit()
+        if len(rebuilt_indexes) > 0:
+            self.create_indexes(rebuilt_indexes)
+
+
+    @measured('DataManager.load_data')
+    def load_data(self, config, columns: list = None, filters: list = None):
+        '''
+        Loads data, clamped with lowerbound and upperbound
+
+        Params
+        ------
+        config: ConfigAgent
+            config agent instance
+        columns: list = None, optional
+            names of the CNumber columns to be loaded, in table order; all columns are loaded if not set
+        filters: list = None, optional
+            filter dicts to be applied; compiled into the query when possible, otherwise applied in memory
+        '''
         lowerbound = config.local.lower_bound
         upperbound = config.local.upper_bound
-        raw_df = pd.read_sql(self.session.query(CNumber).filter(CNumber.value > lowerbound, CNumber.value <= upperbound).statement, self.session.bind)
+        if columns is None:
+            query = self.session.query(CNumber)
+        else:
+            table_columns = [column for column in CNumber.__table__.columns if column.name in columns]
+            missing_columns = set(columns) - set(column.name for column in table_columns)
+            if len(missing_columns) > 0:
+                raise ValueError(f'The db does not contain the columns: {", ".join(sorted(missing_columns))}')
+            query = self.session.query(*table_columns)
+        clauses = []
+        memory_filters = []
+        for filter in filters or []:
+            self._validate_filter(filter)
+            clause = self.compile_filter(filter, upperbound)
+            if clause is None:
+                memory_filters.append(filter)
+                continue
+            clauses.append(clause)
+            if self.filter_indexes and filter['column'] in self.INDEXED_COLUMNS + ['bounded']:
+                self.create_indexes(['peak'] if filter['column'] == 'bounded' else [filter['column']])
+        raw_df = pd.read_sql(query.filter(CNumber.value > lowerbound, CNumber.value <= upperbound, *clauses).statement, self.session.bind)
+        for filter in memory_filters:
+            self.set_data(raw_df)
+            self.add_filter(filter)
+            raw_df = self.apply_filter(filter['name'])
         return raw_df
 
 
+    def compile_filter(self, filter: dict, limit: int):
+        '''
+        Compiles a filter into a sqlalchemy WHERE clause
+
+        Params
+        ------
+        filter: dict
+            a valid filter
+        limit: int
+            the upper bound that the derived 'bounded' column is calculated against
+
+        Returns
+        ------
+        sqlalchemy clause
+            the clause; None if the filter can only be applied in memory
+        '''
+        filter_type = filter['type']
+        parameters = filter['parameters']
+        if filter['column'] == 'bounded':
+            if filter_type not in [self.FilterType.EQL, self.FilterType.LST]:
+                return None
+            flags = [str(parameter) for parameter in parameters]
+            conditions = []
+            if 'True' in flags:
+                conditions.append(CNumber.peak <= limit)
+            if 'False' in flags:
+                conditions.append(CNumber.peak > limit)
+            clause = or_(*conditions) if len(conditions) > 0 else false()
+        else:
+            column = CNumber.__table__.columns.get(filter['column'])
+            if column is None or filter['column'] in ['full_path', 'path_bits']:
+                return None
+            if isinstance(column.type, Boolean):
+                if any(isinstance(parameter, str) for parameter in parameters):
+                    return None
+                # sqlalchemy compares booleans only by equality, the stored flags are 0/1
+                parameters = [int(parameter) for parameter in parameters]
+            if filter_type == self.FilterType.LTE:
+                clause = column <= parameters[0]
+            elif filter_type == self.FilterType.GTE:
+                clause = column >= parameters[0]
+            elif filter_type == self.FilterType.RNG:
+                clause = column.between(parameters[0], parameters[1])
+            elif filter_type == self.FilterType.LST:
+                clause = column.in_(parameters)
+            elif filter_type == self.FilterType.EQL:
+                clause = column == parameters[0]
+
+        return clause if filter['polarity'] else not_(clause)
+
+
+    def create_indexes(self, columns: list = None):
+        '''Creates the missing indexes on the given commonly filtered columns (all of them by default)'''
+        if not inspect(self.engine).has_table(CNumber.__tablename__):
+            return
+        with self.engine.connect() as connection:
+            for column in columns or self.INDEXED_COLUMNS:
+                connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{CNumber.__tablename__}_{column} ON {CNumber.__tablename__} ({column})')
+            connection.commit()
+
+
+    def drop_indexes(self, columns: list = None):
+        '''Drops the indexes on the given commonly filtered columns (all of them by default), e.g. before saving a large range'''
+        with self.engine.connect() as connection:
+            for column in columns or self.INDEXED_COLUMNS:
+                connection.exec_driver_sql(f'DROP INDEX IF EXISTS ix_{CNumber.__tablename__}_{column}')
+            connection.commit()
+
+
+    def get_indexed_columns(self) -> list:
+        '''The commonly filtered columns that are indexed'''
+        inspector = inspect(self.engine)
+        if not inspector.has_table(CNumber.__tablename__):
+            return []
+        index_names = [index['name'] for index in inspector.get_indexes(CNumber.__tablename__)]
+        return [column for column in self.INDEXED_COLUMNS if f'ix_{CNumber.__tablename__}_{column}' in index_names]
+
+
+    @measured('DataManager.get_missing_ranges')
+    def get_missing_ranges(self, lower: int, upper: int) -> list:
+        '''
+        Finds the values in [lower, upper) that are not in the db
+
+        The coverage records are rebuilt from the stored values the first time a db without them
+        (created by an earlier version) is used
+
+        Returns
+        ------
+        list
+            (lower, upper) tuples of the missing ranges, upper exclusive
+        '''
+        if lower >= upper:
+            return []
+        coverage = self.get_coverage()
+        if coverage is None:
+            coverage = self.rebuild_coverage()
+        return subtract_intervals(lower, upper, coverage)
+
+
+    @measured('DataManager.load_properties')
+    def load_properties(self, lower: int, upper: int) -> pd.DataFrame:
+        '''Loads the properties needed to continue the calculation from the numbers stored in [lower, upper)'''
+        columns = ['value', 'dist', 'dist_to_bb', 'closest_vert_value', 'peak']
+        rows = self._fetch_raw(f'SELECT {", ".join(columns)} FROM {CNumber.__tablename__} WHERE value >= ? AND value < ?', (lower, upper))
+        return pd.DataFrame(np.array(rows, dtype=np.int64).reshape(-1, len(columns)), columns=columns)
+
+
+    @measured('DataManager.load_range')
+    def load_range(self, lower: int, upper: int, columns: list) -> pd.DataFrame:
+        '''Loads the given columns of the numbers stored in [lower, upper), in value order'''
+        rows = self._fetch_raw(f'SELECT {", ".join(columns)} FROM {CNumber.__tablename__} WHERE value >= ? AND value < ? ORDER BY value', (lower, upper))
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+
+    def _fetch_raw(self, statement: str, parameters: tuple) -> list:
+        '''Fetches plain tuples through the DB-API cursor, skipping the sqlalchemy row processing'''
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(statement, parameters)
+            return cursor.fetchall()
+        finally:
+            connection.close()
+
+
+    def get_path(self, value: int) -> np.ndarray:
+        '''
+        Rebuilds the full path of a stored number
+
+        Paths stored as parity bits are decoded, paths stored as strings are parsed,
+        paths stored as successor pointers are followed and numbers stored without a path are iterated
+        '''
+        statement = select(CNumber.full_path, CNumber.path_bits).where(CNumber.value == value)
+        row = self.session.execute(statement).first()
+        if row is None:
+            raise ValueError(f'The number {value} is not in the db')
+        full_path, path_bits = row
+        if path_bits is not None:
+            return decode_path(value, path_bits)
+        if full_path is not None:
+            return parse_path_string(full_path)
+        if self.has_successors():
+            suffix = self.get_suffix(value)
+            if suffix is not None:
+                return np.array(suffix)
+        return calculate_path(value)
+
+
+    def has_successors(self) -> bool:
+        '''Whether the db holds successor pointers'''
+        if self.successors_present is None:
+            self.successors_present = inspect(self.engine).has_table(CSuccessor.__tablename__)
+        return self.successors_present
+
+
+    def get_suffix(self, value: int):
+        '''
+        Rebuilds a path by following the successor pointers, down to 1 or to a cached suffix
+
+        The suffixes of the numbers passed on the way are kept in an LRU cache,
+        so the hot suffixes shared by many paths are rebuilt only once
+
+        Returns
+        ------
+        tuple
+            the path after the value; None if the value has no successor pointer
+        '''
+        statement = f'SELECT successor, excursion, excursion_bits FROM {CSuccessor.__tablename__} WHERE value = ?'
+        chain = []
+        node = value
+        while node != 1 and node not in self.suffix_cache:
+            row = self.session.connection().exec_driver_sql(statement, (node,)).first()
+            if row is None:
+                if node == value:
+                    return None
+                # the successor was not saved, finish the path by iteration
+                break
+            steps = get_successor_steps(node, *row)
+            chain.append((node, steps))
+            node = steps[-1]
+
+        if node == 1:
+            suffix = ()
+        elif node in self.suffix_cache:
+            suffix = self.suffix_cache[node]
+            self.suffix_cache.move_to_end(node)
+        else:
+            suffix = tuple(calculate_path(node).tolist())
+
+        for node, steps in reversed(chain):
+            suffix = steps + suffix
+            self.suffix_cache[node] = suffix
+            if len(self.suffix_cache) > self.suffix_cache_size:
+                self.suffix_cache.popitem(last=False)
+
+        return suffix
+
+
+    def migrate_paths(self, batch_size=50000) -> int:
+        '''
+        Re-encodes the paths stored as strings into parity bit blobs and compacts the db
+
+        Returns
+        ------
+        int
+            number of migrated paths
+        '''
+        statement = (f'UPDATE {CNumber.__tablename__} SET path_bits = ?, full_path = NULL WHERE value = ?')
+        migrated = 0
+        last_value = -1
+        with self.engine.connect() as connection:
+            while True:
+                rows = connection.exec_driver_sql(
+                    f'SELECT value, full_path FROM {CNumber.__tablename__} '
+                    'WHERE value > ? AND full_path IS NOT NULL ORDER BY value LIMIT ?', (last_value, batch_size)).fetchall()
+                if len(rows) == 0:
+                    break
+                batch = [(encode_path(value, parse_path_string(full_path).tolist()), value) for value, full_path in rows]
+                connection.exec_driver_sql(statement, batch)
+                connection.commit()
+                migrated += len(rows)
+                last_value = rows[-1][0]
+
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+
+        return migrated
+
+
+    def get_db_size(self) -> int:
+        '''Size of the db file in bytes'''
+        return os.path.getsize(self.db_filepath)
+
+
+    def get_value_bounds(self) -> tuple:
+        '''The lowest stored value and the value above the highest one; None if the db is empty'''
+        if not inspect(self.engine).has_table(CNumber.__tablename__):
+            return None
+        min_value, max_value = self._fetch_raw(f'SELECT MIN(value), MAX(value) FROM {CNumber.__tablename__}', ())[0]
+        if min_value is None:
+            return None
+        return (min_value, max_value + 1)
+
+
     def set_data(self, data: pd.DataFrame):
         self.data = data
 
@@ -120,6 +691,7 @@ class DataManager():
             self._validate_filter(filter)
         except Exception as e:
             raise e
+        self.filters = [listed_filter for listed_filter in self.filters if listed_filter['name'] != filter['name']]
         self.filters.append(filter)
 
 
@@ -150,9 +722,9 @@ class DataManager():
                 filtered_data = self.data[self.data[column_name] < active_filter['parameters'][0]]
         elif active_filter['type'] == self.FilterType.RNG:
             if active_filter['polarity']:
-                filtered_data = self.data[self.data[column_name] >= active_filter['parameters'] and self.data[column_name] <= active_filter['parameters'][0]]
+                filtered_data = self.data[(self.data[column_name] >= active_filter['parameters'][0]) & (self.data[column_name] <= active_filter['parameters'][1])]
             else:
-                filtered_data = self.data[self.data[column_name] < active_filter['parameters'] or self.data[column_name] > active_filter['parameters'][0]]
+                filtered_data = self.data[(self.data[column_name] < active_filter['parameters'][0]) | (self.data[column_name] > active_filter['parameters'][1])]
         elif active_filter['type'] == self.FilterType.LST:
             if active_filter['polarity']:
                 filtered_data = self.data.loc[self.data[column_name].isin(active_filter['parameters'])]
@@ -193,10 +765,56 @@ class DataManager():
         if filter['type'] in [self.FilterType.RNG]:
             if len(filter['parameters']) != 2:
                 raise ValueError('Filter should have at least two parameters')
-            if not isinstance(filter['parameters'][0], int) and not isinstance(filter['parameters'][1], int):
-                raise ValueError('Filter parameters should be both int or float')
-            if not isinstance(filter['parameters'][0], float) and not isinstance(filter['parameters'][1], float):
-                raise ValueError('Filter parameters should be both int or float')
+            for parameter in filter['parameters']:
+                if not isinstance(parameter, int) and not isinstance(parameter, float):
+                    raise ValueError('Filter parameters should be both int or float')
 
         return True
 
+
+
+class DataWriter(Process):
+    '''
+    Saves chunks of data in a separate process, while the next chunks are being calculated
+
+    The queue holds at most queue_size chunks, so the producer waits instead of piling up data.
+    A chunk handed over with its progress block is recorded once it is committed.
+    The writer ignores Ctrl-C, so that the chunks handed over before an interruption are still saved on close
+    '''
+    def __init__(self, db_filepath, save_options=None, queue_size=2, manager_class=None):
+        Process.__init__(self)
+        self.db_filepath = db_filepath
+        self.save_options = save_options if save_options is not None else {}
+        self.queue = Queue(maxsize=queue_size)
+        self.manager_class = manager_class if manager_class is not None else DataManager
+
+    def run(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        data_manager = self.manager_class(self.db_filepath, **self.save_options)
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            data, block = task
+            save_start = time.perf_counter()
+            data_manager.save_data(data)
+            if block is not None:
+                block['save_seconds'] = time.perf_counter() - save_start
+                data_manager.add_progress(block)
+
+    def write(self, data: pd.DataFrame, block: dict = None):
+        '''Hand a chunk over to the writer, waiting while the queue is full'''
+        task = (data, block) if data is not None else None
+        while True:
+            try:
+                self.queue.put(task, timeout=1)
+                return
+            except Full:
+                if not self.is_alive():
+                    raise RuntimeError(f'The data writer stopped unexpectedly (exit code {self.exitcode})')
+
+    def close(self):
+        '''Wait for all handed over chunks to be saved'''
+        if self.is_alive():
+            self.write(None)
+        self.join()
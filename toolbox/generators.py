@@ -1,202 +1,687 @@
-from multiprocessing import Process
+import cProfile
+import os
+import time
+from multiprocessing import Process, Queue
 
 import numpy as np
+import pandas as pd
 
-
-def is_even(value) -> bool:
-    if value % 2 == 0:
-        return True
-    else:
-        return False
+from toolbox.int_kernel import floor_log2, has_odd_parent, is_pow2
+from toolbox.jump_table import JumpTable
+from toolbox.metrics import get_peak_rss_mb
+from toolbox.profiler import get_worker_filepath
+from toolbox.shared_columns import SharedColumns
 
 
 class TailCalculator(Process):
-    def __init__(self, queue, local_lower, local_upper, local_collection, limit):
+    '''
+    Walks each number of a row range until its path drops below the limit, to its tail
+
+    The numbers are read from the value column of the shared tail columns, and the tail, the steps to it (tail_dist),
+    the largest number on the way (tail_peak), the first power of 2 on the way (vert, 0 if none), the steps to it
+    (vert_dist) and the flags are written in their rows. With full paths, the excursions (the numbers from the first
+    step up to the tail) are written into new shared columns, one after the other in row order.
+    The row lower bound and the spec of the excursion columns (None without full paths) are put in the queue.
+    A number whose path peaks above PEAK_LIMIT is flagged instead, its excursion can not be stored
+    '''
+    COLUMNS = {
+        'value': np.int64,
+        'tail': np.int64,
+        'tail_dist': np.int64,
+        'tail_peak': np.int64,
+        'vert': np.int64,
+        'vert_dist': np.int64,
+        'flags': np.uint8,
+    }
+    EXCURSION_COLUMNS = {'node': np.int64}
+    FLAG_IS_BB = 1
+    FLAG_OVERFLOW = 2
+    PEAK_LIMIT = 2**63 - 1
+
+    def __init__(self, queue, columns_spec, row_lower, row_upper, limit, full_path=True):
         Process.__init__(self)
         self.queue = queue
-        self.local_lower = local_lower
-        self.local_upper = local_upper
-        self.local_collection = local_collection
+        self.columns_spec = columns_spec
+        self.row_lower = row_lower
+        self.row_upper = row_upper
+        self.rows = row_upper - row_lower
         self.limit = limit
-
-    def get_target(self, value):
-        if is_even(value):
-            target = int(value/2)
-        else:
-            target = int(value * 3 + 1)
-        return target
-
-    def get_unbound_tail(self, value):
-        out_path = []
-        out_of_bounds = True
+        self.full_path = full_path
+
+    @classmethod
+    def create_columns(cls, lower, upper) -> SharedColumns:
+        '''Shared tail columns of the numbers in [lower, upper), with the values filled in'''
+        columns = SharedColumns(upper - lower, cls.COLUMNS)
+        columns.arrays['value'][:] = np.arange(lower, upper, dtype=np.int64)
+        return columns
+
+    def get_tail(self, value, excursion) -> tuple:
+        '''
+        Walk a number until its path drops below the limit, appending the passed numbers to the excursion list (if any)
+
+        Returns
+        ------
+        tuple
+            tail, steps to it, peak, first power of 2 (0 if none) and steps to it
+        '''
+        limit = self.limit
         target = value
-        while out_of_bounds:
-            target = self.get_target(target)
-            out_path.append(target)
-            if target < self.limit:
-                out_of_bounds = False
-
-        return out_path
+        steps = 0
+        peak = value
+        vert = 0
+        vert_dist = 0
+        while True:
+            target = target >> 1 if target & 1 == 0 else target * 3 + 1
+            steps += 1
+            if excursion is not None:
+                excursion.append(target)
+            if target > peak:
+                peak = target
+            if vert == 0 and target & (target - 1) == 0:
+                vert = target
+                vert_dist = steps
+            if target < limit:
+                return (target, steps, peak, vert, vert_dist)
 
     def run(self):
-        updated_collection = []
-        for record in self.local_collection:
-            new_record = {}
-            new_record['value'] = record['value']
-            new_record['is_bb'] = record['is_bb']
-            new_record['target'] = record['target']
-
-            if record['is_bb']:
-                new_record['tail'] = new_record['target']
-                new_record['tail_path'] = [new_record['target']]
-                updated_collection.append(new_record)
-                continue
-
-            immediate_target = self.get_target(record['value'])
-            new_record['target'] = immediate_target
-            if immediate_target >= self.limit:
-                out_path = self.get_unbound_tail(record['value'])
-                new_record['tail_path'] = out_path
-                new_record['tail'] = out_path[-1]
-            else:
-                new_record['tail'] = immediate_target
-                new_record['tail_path'] = [immediate_target]
-
-            updated_collection.append(new_record)
-
-        self.queue.put(updated_collection)
-
-
-class BBPathCalculator(Process):
-    def __init__(self, queue, local_collection):
+        columns = SharedColumns.attach(self.columns_spec)
+        tail_columns = {column: [] for column in ['tail', 'tail_dist', 'tail_peak', 'vert', 'vert_dist', 'flags']}
+        excursion = [] if self.full_path else None
+        overflow = False
+        for value in columns.arrays['value'][self.row_lower:self.row_upper].tolist():
+            tail, tail_dist, tail_peak, vert, vert_dist = self.get_tail(value, excursion)
+            flags = self.FLAG_IS_BB if value & (value - 1) == 0 else 0
+            if tail_peak > self.PEAK_LIMIT:
+                flags |= self.FLAG_OVERFLOW
+                tail_peak = 0
+                overflow = True
+            tail_columns['tail'].append(tail)
+            tail_columns['tail_dist'].append(tail_dist)
+            tail_columns['tail_peak'].append(tail_peak)
+            tail_columns['vert'].append(vert)
+            tail_columns['vert_dist'].append(vert_dist)
+            tail_columns['flags'].append(flags)
+
+        for column, column_values in tail_columns.items():
+            columns.arrays[column][self.row_lower:self.row_upper] = column_values
+        columns.close()
+
+        excursion_spec = None
+        if self.full_path and not overflow:
+            excursion_columns = SharedColumns(len(excursion), self.EXCURSION_COLUMNS)
+            excursion_columns.arrays['node'][:] = excursion
+            excursion_spec = excursion_columns.get_spec()
+            excursion_columns.close()
+
+        self.queue.put((self.row_lower, excursion_spec))
+
+
+def get_overflow_value(tails: dict):
+    '''The first value flagged by TailCalculator as peaking above the int64 range, None if there is none'''
+    overflow = np.flatnonzero(tails['flags'] & TailCalculator.FLAG_OVERFLOW)
+    return int(tails['value'][overflow[0]]) if len(overflow) > 0 else None
+
+
+def get_resolve_levels(tails: dict, lower: int) -> tuple:
+    '''
+    Group the rows of the tail columns in levels, each row one level after the row of its tail
+
+    The powers of 2 are the roots, their properties and paths do not depend on other numbers.
+    The rows whose tails are in a level make up the next level, so every level can be calculated at once from the
+    levels before it
+
+    Params
+    ------
+    tails: dict
+        the arrays of the tail columns, as written by TailCalculator
+    lower: int
+        value of the first row
+
+    Returns
+    ------
+    tuple
+        the rows of the roots, the row of the tail of each row (-1 for the roots) and the levels (arrays of rows)
+    '''
+    roots = np.flatnonzero(tails['flags'] & TailCalculator.FLAG_IS_BB)
+    parents = tails['tail'] - lower
+    parents[roots] = -1
+    children = np.argsort(parents, kind='stable')
+    sorted_parents = parents[children]
+    levels = []
+    level = roots
+    while True:
+        # the children of each row of the level are a run of the sorted rows
+        begins = np.searchsorted(sorted_parents, level, side='left')
+        counts = np.searchsorted(sorted_parents, level, side='right') - begins
+        offsets = np.cumsum(counts) - counts - begins
+        level = children[np.arange(counts.sum()) - np.repeat(offsets, counts)]
+        if len(level) == 0:
+            break
+        levels.append(level)
+
+    return (roots, parents, levels)
+
+
+def resolve_full_paths(tails: dict, lower: int, excursions: list) -> list:
+    '''
+    Completes the excursion of each number with the full path of its tail
+
+    A power of 2 is only halved, so its full path is known; the other rows are visited level by level
+    (see get_resolve_levels), so the full path of every tail is complete before its numbers use it
+
+    Params
+    ------
+    tails: dict
+        the arrays of the tail columns, as written by TailCalculator
+    lower: int
+        value of the first row
+    excursions: list
+        the node arrays of the excursion columns, in row order
+
+    Returns
+    ------
+    list
+        the full path of each row (None if it could not be resolved)
+    '''
+    roots, parents, levels = get_resolve_levels(tails, lower)
+    nodes = []
+    for excursion in excursions:
+        nodes.extend(excursion.tolist())
+    ends = np.cumsum(tails['tail_dist']).tolist()
+    tail_dist = tails['tail_dist'].tolist()
+    parents = parents.tolist()
+    full_paths = [None] * len(tail_dist)
+    for row in roots.tolist():
+        value = lower + row
+        full_paths[row] = [value >> shift for shift in range(1, value.bit_length())]
+    for level in levels:
+        for row in level.tolist():
+            end = ends[row]
+            path = nodes[end - tail_dist[row]:end]
+            path.extend(full_paths[parents[row]])
+            full_paths[row] = path
+
+    return full_paths
+
+
+def resolve_properties(tails: dict, lower: int) -> tuple:
+    '''
+    Calculates the number properties from the tail columns, without the full paths
+
+    A number takes its properties from its tail (the first number of its path inside the range)
+    and the excursion to it: dist(n) = tail_dist(n) + dist(tail), peak(n) = max(tail_peak(n), peak(tail)),
+    and its closest vertebrae is the first power of 2 of the excursion, or else the one of the tail.
+    The rows are calculated level by level (see get_resolve_levels), so every tail is calculated before its numbers
+
+    Params
+    ------
+    tails: dict
+        the arrays of the tail columns, as written by TailCalculator
+    lower: int
+        value of the first row
+
+    Returns
+    ------
+    tuple
+        the numbers of the range in the CNumber columns (pd.DataFrame, without full paths)
+        and the number of rows that could not be resolved
+    '''
+    roots, parents, levels = get_resolve_levels(tails, lower)
+    length = len(parents)
+    values = np.arange(lower, lower + length, dtype=np.int64)
+    dist = np.zeros(length, dtype=np.int64)
+    dist_to_bb = np.zeros(length, dtype=np.int64)
+    closest_vert_value = np.zeros(length, dtype=np.int64)
+    peak = np.zeros(length, dtype=np.int64)
+    dist[roots] = floor_log2(values[roots])
+    closest_vert_value[roots] = values[roots]
+    peak[roots] = values[roots]
+    for level in levels:
+        parent = parents[level]
+        tail_dist = tails['tail_dist'][level]
+        vert = tails['vert'][level]
+        no_vert = vert == 0
+        dist[level] = tail_dist + dist[parent]
+        peak[level] = np.maximum(tails['tail_peak'][level], peak[parent])
+        closest_vert_value[level] = np.where(no_vert, closest_vert_value[parent], vert)
+        dist_to_bb[level] = np.where(no_vert, tail_dist + dist_to_bb[parent], tails['vert_dist'][level])
+
+    columns = {}
+    columns['value'] = values
+    columns['is_bb'] = is_pow2(values)
+    columns['dist'] = dist
+    columns['dist_to_bb'] = dist_to_bb
+    columns['closest_vert_value'] = closest_vert_value
+    columns['closest_vert'] = floor_log2(closest_vert_value)
+    columns['peak'] = peak
+    columns['peak_slope'] = peak / values
+    columns['odd_parent'] = has_odd_parent(values)
+    unresolved_count = length - len(roots) - sum(len(level) for level in levels)
+
+    return (pd.DataFrame(columns), unresolved_count)
+
+
+class StageWorker(Process):
+    '''Persistent worker process, running the calculator stages it receives until it gets None'''
+    def __init__(self, task_queue, result_queue, metrics_queue, worker_index):
         Process.__init__(self)
-        self.queue = queue
-        self.local_collection = local_collection
+        self.task_queue = task_queue
+        self.result_queue = result_queue
+        self.metrics_queue = metrics_queue
+        self.worker_index = worker_index
 
     def run(self):
-        updated_collection = []
-        for record in self.local_collection:
-            new_record = {}
-            new_record['value'] = record['value']
-            new_record['is_bb'] = record['is_bb']
-            new_record['target'] = record['target']
-            new_record['tail'] = record['tail']
-            new_record['tail_path'] = record['tail_path']
-
-            if record['is_bb']:
-                new_record['tail_path'] = self.get_full_bb_path(
-                    new_record['value'])
-                new_record['tail'] = new_record['tail_path'][-1]
-                updated_collection.append(new_record)
-
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            calculator_class, parameters, task_index, profile_filepath_prefix = task
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            calculator = calculator_class(queue=self.result_queue, **parameters)
+            if profile_filepath_prefix is not None:
+                profile = cProfile.Profile()
+                profile.runcall(calculator.run)
+                profile.dump_stats(get_worker_filepath(profile_filepath_prefix, calculator_class.__name__, task_index, os.getpid()))
             else:
-                new_record['tail_path'] = record['tail_path']
-                updated_collection.append(new_record)
-
-        self.queue.put(updated_collection)
-
-    def get_target(self, value):
-        if is_even(value):
-            target = int(value/2)
-        else:
-            target = int(value * 3 + 1)
-        return target
-
-    def get_full_bb_path(self, start_value):
-        path = []
-        target = start_value
-        while target != 1:
-            target = self.get_target(target)
-            path.append(target)
-
+                calculator.run()
+            self.metrics_queue.put({
+                'worker': self.worker_index,
+                'task': task_index,
+                'wall_seconds': time.perf_counter() - wall_start,
+                'cpu_seconds': time.process_time() - cpu_start,
+                'peak_rss_mb': get_peak_rss_mb(),
+                'rows': getattr(calculator, 'rows', None),
+            })
+
+
+class StagePool():
+    '''
+    Pool of persistent worker processes, reused by all the calculator stages of a run
+
+    The per-task metrics of the workers for the last stage are kept in stage_metrics;
+    while the profiler is active, the tasks are profiled in the workers too
+    '''
+    def __init__(self, process_count, profiler=None):
+        self.profiler = profiler
+        self.task_queue = Queue()
+        self.result_queue = Queue()
+        self.metrics_queue = Queue()
+        self.stage_metrics = []
+        self.workers = [StageWorker(self.task_queue, self.result_queue, self.metrics_queue, worker_index) for worker_index in range(process_count)]
+        for worker in self.workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run_stage(self, calculator_class, stage_parameters: list) -> list:
+        '''Run a calculator once for each set of parameters and collect the results'''
+        for task_index, parameters in enumerate(stage_parameters):
+            profile_filepath_prefix = None
+            if self.profiler is not None and self.profiler.active:
+                profile_filepath_prefix = self.profiler.filepath_prefix
+            self.task_queue.put((calculator_class, parameters, task_index, profile_filepath_prefix))
+
+        results = []
+        for _ in stage_parameters:
+            results.append(self.result_queue.get())
+        self.stage_metrics = sorted([self.metrics_queue.get() for _ in stage_parameters], key=lambda task_metrics: task_metrics['task'])
+
+        return results
+
+    def close(self):
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+class MemoizedCalculator():
+    '''
+    Calculates the properties of all numbers below a limit, in value order
+
+    Each number is iterated only until its path drops below the number itself,
+    the rest of the properties are read from the dense arrays of the numbers already calculated.
+    Only the numbers below memo_limit are kept in the dense arrays, larger numbers are iterated
+    until they drop below memo_limit, so the memory use does not depend on the limit.
+    The full paths, much larger than the dense arrays, are kept only below path_memo_limit (memo_limit by default);
+    the paths of larger numbers are rebuilt by walking down to a kept path when they are reused.
+    The dense arrays can be seeded with numbers already stored, in which case only the
+    missing ranges need to be calculated.
+    Without full paths, the walks above memo_limit advance jump_bits steps at once through a jump table.
+    The peaks are stored as int64, a number whose path goes above PEAK_LIMIT stops the calculation with a ValueError
+    '''
+    PEAK_LIMIT = 2**63 - 1
+
+    def __init__(self, limit, full_path=True, memo_limit=None, jump_bits=0, path_memo_limit=None):
+        self.limit = limit
+        self.full_path = full_path
+        self.memo_limit = limit if not memo_limit else min(limit, memo_limit)
+        self.path_memo_limit = self.memo_limit if not path_memo_limit else max(min(self.memo_limit, path_memo_limit), 2)
+        self.jump_table = JumpTable(jump_bits) if jump_bits > 0 and not full_path else None
+        self.dist = np.zeros(self.memo_limit, dtype=np.int64)
+        self.dist_to_bb = np.zeros(self.memo_limit, dtype=np.int64)
+        self.closest_vert_value = np.ones(self.memo_limit, dtype=np.int64)
+        self.peak = np.ones(self.memo_limit, dtype=np.int64)
+        self.paths = [None] * self.path_memo_limit if full_path else None
+        if full_path:
+            self.paths[1] = []
+
+    def seed(self, data: pd.DataFrame):
+        '''
+        Fill the dense arrays with numbers calculated earlier
+
+        The paths of the seeded numbers are rebuilt only when they are reused
+
+        Params
+        ------
+        data: pd.DataFrame
+            value, dist, dist_to_bb, closest_vert_value and peak of the stored numbers
+        '''
+        data = data[data['value'] < self.memo_limit]
+        values = data['value'].to_numpy()
+        for column in ['dist', 'dist_to_bb', 'closest_vert_value', 'peak']:
+            getattr(self, column)[values] = data[column].to_numpy()
+
+    def get_memo_path(self, value) -> list:
+        '''Full path of a number from the kept paths, rebuilding it if the number was seeded or is not kept'''
+        if value >= self.path_memo_limit:
+            return self.rebuild_path(value)
+        path = self.paths[value]
+        if path is None:
+            path = self.rebuild_path(value)
+            self.paths[value] = path
         return path
 
+    def rebuild_path(self, value) -> list:
+        '''
+        Walk the path of a number down to the first number with a kept path
 
-class PathCalculator(Process):
-    def __init__(self, queue, local_collection, full_collection):
-        Process.__init__(self)
-        self.queue = queue
-        self.local_collection = local_collection
-        self.full_collection = full_collection
-
-    def run(self):
-        updated_collection = []
-        for record in self.local_collection:
-            new_record = {}
-            new_record['value'] = record['value']
-            new_record['is_bb'] = record['is_bb']
-            new_record['target'] = record['target']
-            new_record['tail_path'] = record['tail_path']
-            target_full_path = self.get_target_tail_path(record['tail'])
-            new_record['tail_path'].extend(target_full_path)
-            new_record['tail'] = new_record['tail_path'][-1]
-            updated_collection.append(new_record)
-
-        self.queue.put(updated_collection)
-
-    def get_target_tail_path(self, value):
-        for record in self.full_collection:
-            if record['value'] == value:
-                return record['tail_path']
-
-
-class FullPropertiesCalculator(Process):
-    def __init__(self, queue, local_collection):
-        Process.__init__(self)
-        self.queue = queue
-        self.local_collection = local_collection
-
-    def run(self):
-        number_collection = []
-        for number in self.local_collection:
-            number['full_path'] = number['tail_path']
-            number['dist'] = len(number['full_path'])
-            dist_to_bb, closest_vert_value = self.get_bb_from_path(
-                number['full_path'])
-            number['dist_to_bb'] = 0 if number['is_bb'] else dist_to_bb
-            number['closest_vert_value'] = number['value'] if number['is_bb'] else closest_vert_value
-            number['closest_vert'] = int(np.log2(number['closest_vert_value']))
-            number['peak'] = self.get_peak(
-                number['value'], number['full_path'])
-            number['peak_slope'] = self.get_peak_slope(
-                number['value'], number['peak'])
-            number['odd_parent'] = self.get_odd_parent(number['value'])
-
-            number_collection.append(number)
-
-        self.queue.put(number_collection)
-
-    def is_bb(self, value) -> bool:
-        log2 = np.log2(value)
-        if log2 % 1 == 0:
-            return True
-        return False
-
-    def get_bb_from_path(self, full_path):
-        not_bb_nodes = []
-        largest_vert = 0
-        for node in full_path:
-            if self.is_bb(node):
-                largest_vert = max(largest_vert, node)
+        Iterating is cheaper than loading the path from the db, one query per number
+        '''
+        excursion = []
+        target = value
+        while target >= self.path_memo_limit or self.paths[target] is None:
+            target = target >> 1 if target & 1 == 0 else target * 3 + 1
+            excursion.append(target)
+
+        return excursion + self.paths[target]
+
+    def calculate(self, value) -> tuple:
+        '''
+        Walk the path of a number until it drops below the number (or memo_limit)
+
+        Returns
+        ------
+        tuple
+            dist, dist_to_bb, closest_vert_value, peak and full path (None if full paths are not kept)
+        '''
+        floor = min(value, self.memo_limit)
+        excursion = []
+        # the walks down to the number itself are too short to gain from jumps
+        if self.jump_table is not None and floor < value:
+            steps, peak, closest_vert_value, dist_to_bb, target = self.jump_table.walk(value, floor)
+        else:
+            steps = 0
+            peak = value
+            closest_vert_value = 0
+            dist_to_bb = 0
+            target = value
+            while target >= floor:
+                target = target >> 1 if target & 1 == 0 else target * 3 + 1
+                steps += 1
+                if self.full_path:
+                    excursion.append(target)
+                if target > peak:
+                    peak = target
+                if closest_vert_value == 0 and target & (target - 1) == 0:
+                    closest_vert_value = target
+                    dist_to_bb = steps
+
+        if peak > self.PEAK_LIMIT:
+            self.raise_peak_overflow(value)
+        if value & (value - 1) == 0:
+            closest_vert_value = value
+            dist_to_bb = 0
+        elif closest_vert_value == 0:
+            closest_vert_value = int(self.closest_vert_value[target])
+            dist_to_bb = steps + int(self.dist_to_bb[target])
+
+        dist = steps + int(self.dist[target])
+        peak = max(peak, int(self.peak[target]))
+        path = excursion + self.get_memo_path(target) if self.full_path else None
+        if value < self.memo_limit:
+            self.dist[value] = dist
+            self.peak[value] = peak
+            self.closest_vert_value[value] = closest_vert_value
+            self.dist_to_bb[value] = dist_to_bb
+        if self.full_path and value < self.path_memo_limit:
+            self.paths[value] = path
+
+        return (dist, dist_to_bb, closest_vert_value, peak, path)
+
+    @classmethod
+    def raise_peak_overflow(cls, value):
+        raise ValueError(f'The path of {value} peaks above {cls.PEAK_LIMIT}, the largest value the number columns can store')
+
+    def run(self, ranges=None) -> pd.DataFrame:
+        '''Calculate the numbers in the ranges [lower, upper) (all numbers below the limit by default)'''
+        if ranges is None:
+            ranges = [(2, self.limit)]
+        chunks = [self.calculate_chunk(lower, upper) for lower, upper in ranges]
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True)
+
+    def generate_chunks(self, chunk_size, ranges=None):
+        '''Calculate the numbers in chunks of values, yielding each chunk as soon as it is done'''
+        if ranges is None:
+            ranges = [(2, self.limit)]
+        for range_lower, range_upper in ranges:
+            for lower in range(range_lower, range_upper, chunk_size):
+                upper = min(lower + chunk_size, range_upper)
+                yield self.calculate_chunk(lower, upper)
+
+    def calculate_chunk(self, lower, upper) -> pd.DataFrame:
+        '''Calculate the numbers in [lower, upper); all numbers below lower should already be calculated'''
+        chunk = {'dist': [], 'dist_to_bb': [], 'closest_vert_value': [], 'peak': [], 'full_path': []}
+        for value in range(lower, upper):
+            dist, dist_to_bb, closest_vert_value, peak, path = self.calculate(value)
+            chunk['dist'].append(dist)
+            chunk['dist_to_bb'].append(dist_to_bb)
+            chunk['closest_vert_value'].append(closest_vert_value)
+            chunk['peak'].append(peak)
+            chunk['full_path'].append(path)
+
+        return self.get_collection(lower, upper, chunk)
+
+    def get_collection(self, lower, upper, chunk: dict) -> pd.DataFrame:
+        '''Collect the calculated properties of the numbers in [lower, upper) in the CNumber columns'''
+        values = np.arange(lower, upper, dtype=np.int64)
+        closest_vert_value = np.asarray(chunk['closest_vert_value'], dtype=np.int64)
+        peak = np.asarray(chunk['peak'], dtype=np.int64)
+        collection = {}
+        collection['value'] = values
+        collection['is_bb'] = is_pow2(values)
+        if self.full_path:
+            collection['full_path'] = chunk['full_path']
+        collection['dist'] = np.asarray(chunk['dist'], dtype=np.int64)
+        collection['dist_to_bb'] = np.asarray(chunk['dist_to_bb'], dtype=np.int64)
+        collection['closest_vert_value'] = closest_vert_value
+        collection['closest_vert'] = floor_log2(closest_vert_value)
+        collection['peak'] = peak
+        collection['peak_slope'] = peak / values
+        collection['odd_parent'] = has_odd_parent(values)
+
+        return pd.DataFrame(collection)
+
+
+class VectorizedCalculator(MemoizedCalculator):
+    '''
+    Calculates the properties of all numbers below a limit, one block of values at a time
+
+    All numbers in a block are advanced together as a uint64 array, until each of them drops
+    below the block (or memo_limit); the rest of the properties are read from the dense arrays.
+    A number whose path peaks above the signed 64 bit range (as stored in the arrays and the db)
+    can not be stored, so it stops the calculation with a ValueError.
+    Without full paths, the lanes advance jump_bits steps at once wherever the jump table allows it
+    '''
+    OVERFLOW_LIMIT = (2**63 - 2) // 3
+
+    def __init__(self, limit, full_path=True, block_size=65536, memo_limit=None, jump_bits=0, path_memo_limit=None):
+        MemoizedCalculator.__init__(self, limit, full_path, memo_limit, jump_bits, path_memo_limit)
+        self.block_size = block_size
+
+    def calculate_chunk(self, lower, upper) -> pd.DataFrame:
+        blocks = []
+        for block_lower in range(lower, upper, self.block_size):
+            block_upper = min(block_lower + self.block_size, upper)
+            blocks.append(self.calculate_block(block_lower, block_upper))
+
+        chunk = {}
+        for column in ['dist', 'dist_to_bb', 'closest_vert_value', 'peak']:
+            chunk[column] = np.concatenate([block[column] for block in blocks])
+        chunk['full_path'] = [path for block in blocks for path in block['full_path']] if self.full_path else None
+
+        return self.get_collection(lower, upper, chunk)
+
+    def calculate_block(self, lower, upper) -> dict:
+        '''Advance all the numbers in [lower, upper) until each of them drops below lower (or memo_limit)'''
+        floor = min(lower, self.memo_limit)
+        block_length = upper - lower
+        block = {}
+        block['dist'] = np.zeros(block_length, dtype=np.int64)
+        block['dist_to_bb'] = np.zeros(block_length, dtype=np.int64)
+        block['closest_vert_value'] = np.zeros(block_length, dtype=np.int64)
+        block['peak'] = np.zeros(block_length, dtype=np.int64)
+        block['landing'] = np.zeros(block_length, dtype=np.int64)
+        lane = np.arange(block_length)
+        current = np.arange(lower, upper, dtype=np.uint64)
+        steps = np.zeros(block_length, dtype=np.int64)
+        peak = current.copy()
+        vert = np.zeros(block_length, dtype=np.uint64)
+        vert_steps = np.zeros(block_length, dtype=np.int64)
+        logged_lanes = []
+        logged_values = []
+
+        sieved = self.sieve_lanes(block, lower, floor, current, logged_lanes, logged_values)
+        keep = ~sieved
+        lane, current, steps, peak, vert, vert_steps = (
+            lane[keep], current[keep], steps[keep], peak[keep], vert[keep], vert_steps[keep])
+
+        while len(lane) > 0:
+            odd = (current & 1) == 1
+            overflow = odd & (current > self.OVERFLOW_LIMIT)
+            if overflow.any():
+                # the next step is the new peak, beyond the int64 columns
+                self.raise_peak_overflow(lower + int(lane[np.flatnonzero(overflow)[0]]))
+
+            if self.jump_table is not None:
+                # a jump never passes the first power of 2, so only the single steps can find it
+                jumped, jump_end, jump_steps, jump_peak = self.jump_table.advance(current, floor, vert)
+                current = np.where(jumped, jump_end, np.where(odd, current * 3 + 1, current >> 1))
+                steps += np.where(jumped, jump_steps, 1)
+                np.maximum(peak, np.where(jumped, jump_peak, current), out=peak)
+                first_vert = ~jumped & (vert == 0) & ((current & (current - 1)) == 0)
             else:
-                not_bb_nodes.append(node)
-
-        return (len(not_bb_nodes) + 1, largest_vert)
-
-    def get_peak(self, value, full_path):
-        peak = max(full_path)
-        peak = max(value, peak)
-        return peak
-
-    def get_peak_slope(self, value, peak):
-        peak_slope = peak / value
-        return peak_slope
-
-    def get_odd_parent(self, value):
-        potential = (value - 1) / 3
-        if potential < 0:
-            return False
-        if potential % 1 == 0:
-            if int(potential) % 2 != 0:
-                return True
-        return False
+                current = np.where(odd, current * 3 + 1, current >> 1)
+                steps += 1
+                np.maximum(peak, current, out=peak)
+                first_vert = (vert == 0) & ((current & (current - 1)) == 0)
+            vert[first_vert] = current[first_vert]
+            vert_steps[first_vert] = steps[first_vert]
+            if self.full_path:
+                logged_lanes.append(lane)
+                logged_values.append(current)
+
+            done = current < floor
+            if done.any():
+                self.finish_lanes(block, lower, lane[done], current[done], steps[done], peak[done], vert[done], vert_steps[done])
+                keep = ~done
+                lane, current, steps, peak, vert, vert_steps = (
+                    lane[keep], current[keep], steps[keep], peak[keep], vert[keep], vert_steps[keep])
+
+        if self.full_path:
+            block['full_path'] = self.assemble_paths(block_length, logged_lanes, logged_values, block['landing'])
+
+        # keep the numbers below memo_limit for the blocks to come
+        stored = min(upper, self.memo_limit) - lower
+        if stored > 0:
+            for column in ['dist', 'dist_to_bb', 'closest_vert_value', 'peak']:
+                getattr(self, column)[lower:lower + stored] = block[column][:stored]
+        stored_paths = min(upper, self.path_memo_limit) - lower
+        if self.full_path and stored_paths > 0:
+            self.paths[lower:lower + stored_paths] = block['full_path'][:stored_paths]
+
+        return block
+
+    def sieve_lanes(self, block, lower, floor, current, logged_lanes, logged_values) -> np.ndarray:
+        '''
+        Finish the numbers whose first steps are set by their residue, without advancing them as lanes
+
+        An even n lands on n / 2 in 1 step, an n = 1 mod 4 lands on (3n + 1) / 4 in 3 steps, with 3n + 1 as the peak
+        of the steps; when the landing is below the floor, the rest is read from the dense arrays.
+        Only the numbers 3 mod 4 and the ones landing inside the block are left to the lanes
+
+        Returns
+        ------
+        np.ndarray
+            mask of the finished lanes
+        '''
+        even = (current & 1) == 0
+        one_mod_four = ((current & 3) == 1) & (current <= self.OVERFLOW_LIMIT)
+        tripled = current * 3 + 1
+        landing = np.where(even, current >> 1, tripled >> 2)
+        sieved = (even | one_mod_four) & (landing < floor)
+        lane = np.flatnonzero(sieved)
+        even, tripled, landing = even[lane], tripled[lane], landing[lane]
+        # 3n + 1 (and so its half) is the only power of 2 the steps of an n = 1 mod 4 can pass before landing
+        tripled_bb = ~even & ((tripled & (tripled - 1)) == 0)
+        steps = np.where(even, 1, 3)
+        peak = np.where(even, current[lane], tripled)
+        vert = np.where(tripled_bb, tripled, 0).astype(np.uint64)
+        vert_steps = tripled_bb.astype(np.int64)
+        if self.full_path:
+            odd_lane = lane[~even]
+            logged_lanes.extend([lane[even], odd_lane, odd_lane, odd_lane])
+            logged_values.extend([landing[even], tripled[~even], tripled[~even] >> 1, landing[~even]])
+        self.finish_lanes(block, lower, lane, landing, steps, peak, vert, vert_steps)
+
+        return sieved
+
+    def finish_lanes(self, block, lower, lane, current, steps, peak, vert, vert_steps):
+        '''Combine the walked part of the paths with the properties of the numbers they landed on'''
+        values = lane + lower
+        target = current.astype(np.int64)
+        no_vert = vert == 0
+        is_bb = values & (values - 1) == 0
+        closest_vert_value = np.where(no_vert, self.closest_vert_value[target], vert.astype(np.int64))
+        dist_to_bb = np.where(no_vert, steps + self.dist_to_bb[target], vert_steps)
+        block['dist'][lane] = steps + self.dist[target]
+        block['peak'][lane] = np.maximum(peak.astype(np.int64), self.peak[target])
+        block['closest_vert_value'][lane] = np.where(is_bb, values, closest_vert_value)
+        block['dist_to_bb'][lane] = np.where(is_bb, 0, dist_to_bb)
+        block['landing'][lane] = target
+
+    def assemble_paths(self, block_length, logged_lanes, logged_values, landing) -> list:
+        '''Group the logged steps by number and complete them with the paths of the numbers they landed on'''
+        lanes = np.concatenate(logged_lanes)
+        values = np.concatenate(logged_values)
+        order = np.argsort(lanes, kind='stable')
+        values = values[order].tolist()
+        ends = np.cumsum(np.bincount(lanes, minlength=block_length)).tolist()
+        landing = landing.tolist()
+        paths = []
+        begin = 0
+        for lane in range(block_length):
+            end = ends[lane]
+            path = values[begin:end]
+            path.extend(self.get_memo_path(landing[lane]))
+            paths.append(path)
+            begin = end
+
+        return paths
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+'''
+Exact integer operations of the collatz iteration, on scalars and on numpy integer arrays
+
+Bit operations only, so python ints stay exact at any size and numpy arrays stay exact over the whole int64 range,
+where float math (np.log2, value / 2) loses precision above 2^53
+'''
+
+
+def is_even(value):
+    return value & 1 == 0
+
+
+def is_pow2(value):
+    '''Whether the value is a power of 2 (a vertebrae)'''
+    if isinstance(value, np.ndarray):
+        return (value > 0) & (value & (value - 1) == 0)
+    return value > 0 and value & (value - 1) == 0
+
+
+def halve(value):
+    return value >> 1
+
+
+def triple_plus_one(value):
+    return value * 3 + 1
+
+
+def get_next(value):
+    '''The next value of the collatz iteration'''
+    if isinstance(value, np.ndarray):
+        return np.where(value & 1 == 0, value >> 1, value * 3 + 1)
+    return value >> 1 if value & 1 == 0 else value * 3 + 1
+
+
+def floor_log2(value):
+    '''The exponent of the largest power of 2 not above a positive value (the vertebrae power of a power of 2)'''
+    if isinstance(value, np.ndarray):
+        # the exponent bits of the float64, which rounds to the nearest, so it can only be one too high
+        exponents = value.astype(np.float64).view(np.int64)
+        exponents >>= 52
+        exponents -= 1023
+        np.minimum(exponents, 62, out=exponents)
+        exponents -= np.left_shift(1, exponents) > value
+        return exponents
+    return int(value).bit_length() - 1
+
+
+def has_odd_parent(value):
+    '''
+    Whether the value is reached from an odd number, n = 3 * parent + 1 with an odd parent
+
+    (value - 1) / 3 is an odd integer exactly when value % 6 == 4
+    '''
+    return value % 6 == 4
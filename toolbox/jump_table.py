@@ -0,0 +1,128 @@
+import numpy as np
+
+
+'''
+Advances collatz walks by bits halving steps at once, for the walks that only need the number properties, not the paths
+
+A number n = a * 2^bits + b reaches multiplier[b] * a + addend[b] after bits halvings and odd_steps[b] 3n+1 steps,
+the low bits b decide the parity of each of these steps.
+Every value passed on the way is alpha * a + beta for a pair (alpha, beta) that only depends on b, so the table also keeps
+- the pair with the steepest alpha, which is the largest of the passed values (the peak) once a reaches peak_threshold[b]
+- the smallest alpha and beta, a lower bound of the passed values (the walk does not drop below the floor)
+
+A jump is taken only when it is exact: the peak of the jump is known, the walk does not drop below the floor
+and no power of 2 is passed before the first one is found; otherwise the walk falls back to single steps
+'''
+
+# largest value the uint64 lanes can reach during a jump
+LANE_LIMIT = 2**63 - 1
+
+
+class JumpTable():
+    def __init__(self, bits: int = 8):
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        size = 1 << bits
+        alpha = np.full(size, 1 << bits, dtype=np.int64)
+        beta = np.arange(size, dtype=np.int64)
+        odd_steps = np.zeros(size, dtype=np.int64)
+        low_alpha = alpha.copy()
+        low_beta = beta.copy()
+        # the values after each 3n+1 step are the only candidates for the peak
+        peak_alphas = [alpha.copy()]
+        peak_betas = [beta.copy()]
+        for _ in range(bits):
+            odd = (beta & 1) == 1
+            alpha = np.where(odd, alpha * 3, alpha)
+            beta = np.where(odd, beta * 3 + 1, beta)
+            odd_steps += odd
+            peak_alphas.append(alpha)
+            peak_betas.append(beta)
+            # alpha keeps a factor 2 until the last halving, so the parity is decided by beta alone
+            alpha = alpha >> 1
+            beta = beta >> 1
+            np.minimum(low_alpha, alpha, out=low_alpha)
+            np.minimum(low_beta, beta, out=low_beta)
+
+        peak_alphas = np.stack(peak_alphas)
+        peak_betas = np.stack(peak_betas)
+        columns = np.arange(size)
+        steepest = np.lexsort((peak_betas, peak_alphas), axis=0)[-1]
+        peak_alpha = peak_alphas[steepest, columns]
+        peak_beta = peak_betas[steepest, columns]
+        # the steepest line is above each of the others from the a where they cross
+        slope_gaps = peak_alpha - peak_alphas
+        overtaken = (slope_gaps > 0) & (peak_betas > peak_beta)
+        crossings = np.where(overtaken, -((peak_beta - peak_betas) // np.where(overtaken, slope_gaps, 1)), 0)
+
+        self.multiplier = alpha
+        self.addend = beta
+        self.steps = odd_steps + bits
+        self.peak_alpha = peak_alpha
+        self.peak_beta = peak_beta
+        self.peak_threshold = crossings.max(axis=0)
+        self.low_alpha = low_alpha
+        self.low_beta = low_beta
+        self.lane_limit = np.array([(LANE_LIMIT - max(int(peak_beta[index]), int(beta[index]))) // int(peak_alpha[index])
+                                    for index in range(size)], dtype=np.int64)
+        # python int rows for the scalar walks, one lookup per jump
+        self.rows = list(zip(self.peak_threshold.tolist(), low_alpha.tolist(), low_beta.tolist(), alpha.tolist(),
+                             beta.tolist(), self.steps.tolist(), peak_alpha.tolist(), peak_beta.tolist()))
+
+    def walk(self, value: int, floor: int) -> tuple:
+        '''
+        Walk a number until it drops below the floor
+
+        Returns
+        ------
+        tuple
+            steps, peak, first power of 2 (0 if none was passed), steps to it and the value below the floor
+        '''
+        mask = self.mask
+        bits = self.bits
+        rows = self.rows
+        steps = 0
+        peak = value
+        vert = 0
+        vert_steps = 0
+        target = value
+        while target >= floor:
+            high = target >> bits
+            threshold, low_alpha, low_beta, multiplier, addend, jump_steps, peak_alpha, peak_beta = rows[target & mask]
+            if high >= threshold and low_alpha * high + low_beta >= floor:
+                end = multiplier * high + addend
+                if vert != 0 or end & (end - 1) != 0:
+                    jump_peak = peak_alpha * high + peak_beta
+                    if jump_peak > peak:
+                        peak = jump_peak
+                    steps += jump_steps
+                    target = end
+                    continue
+            target = target >> 1 if target & 1 == 0 else target * 3 + 1
+            steps += 1
+            if target > peak:
+                peak = target
+            if vert == 0 and target & (target - 1) == 0:
+                vert = target
+                vert_steps = steps
+
+        return (steps, peak, vert, vert_steps, target)
+
+    def advance(self, current: np.ndarray, floor: int, vert: np.ndarray) -> tuple:
+        '''
+        Jump the uint64 lanes for which a jump is exact
+
+        Returns
+        ------
+        tuple
+            mask of the jumped lanes, their new values, steps and peaks (meaningful only for the jumped lanes)
+        '''
+        low = (current & np.uint64(self.mask)).astype(np.intp)
+        high = (current >> np.uint64(self.bits)).astype(np.int64)
+        jumped = (high >= self.peak_threshold[low]) & (high <= self.lane_limit[low])
+        jumped &= self.low_alpha[low] * high + self.low_beta[low] >= floor
+        end = (self.multiplier[low] * high + self.addend[low]).astype(np.uint64)
+        jumped &= (vert != 0) | ((end & (end - np.uint64(1))) != 0)
+        jump_peak = (self.peak_alpha[low] * high + self.peak_beta[low]).astype(np.uint64)
+
+        return (jumped, end, self.steps[low], jump_peak)
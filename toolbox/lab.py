@@ -8,13 +8,15 @@ from logging import Logger
 
 import numpy as np
 import pandas as pd
-from progress.bar import Bar
 from pytoolbox.bokeh_agent import BokehScatterAgent
 from pytoolbox.config_agent import ConfigAgent
 
 import toolbox.mappings as mappings
 from toolbox import STASH_FOLDER
 from toolbox.data_manager import DataManager
+from toolbox.int_kernel import is_pow2
+from toolbox.metrics import RunMetrics
+from toolbox.profiler import Profiler
 
 
 def init_log(logger: Logger, config: ConfigAgent, start: datetime.time):
@@ -25,17 +27,50 @@ def init_log(logger: Logger, config: ConfigAgent, start: datetime.time):
 
 def get_data(logger: Logger, config: ConfigAgent, data_manager: DataManager) -> pd.DataFrame:
     logger.debug('Loading data from file')
-    data_df = data_manager.load_data(config)
-    # TBD
-    # data_df = cnumber_list_to_df(data_list)
+    columns = get_plot_columns(config)
+    logger.debug(f'Loading columns: {", ".join(columns)}')
+    filters = []
     if config.filters.filter_data:
          logger.info(f'Filtering data: {config.filters.filter_name}')
-         data_df = filter_data(config, data_df)
+         filters.append(get_filter(config))
          config.add_parameter('local', 'filter_name', config.filters.filter_name)
+    # TBD
+    # data_df = cnumber_list_to_df(data_list)
+    data_df = data_manager.load_data(config, columns, filters)
 
     return data_df
 
 
+def get_plot_columns(config: ConfigAgent) -> list:
+    '''
+    Works out the minimal set of db columns needed for a plot
+
+    Params
+    ------
+    config: ConfigAgent
+        config agent instance
+
+    Returns
+    ------
+    list
+        names of the db columns used by the axes, the colorization, the tooltips and the active filter
+    '''
+    plot_columns = ['value', 'is_bb']
+    plot_columns.append(mappings.y_axis_parameter[config.plot.y_axis])
+    plot_columns.append(mappings.colorization_field[config.plot.colorization_value])
+    plot_columns.extend(config.plot.tooltips)
+    if config.filters.filter_data:
+        plot_columns.append(config.filters.filter_column)
+
+    columns = []
+    for column in plot_columns:
+        for db_column in mappings.derived_columns.get(column, [column]):
+            if db_column not in columns:
+                columns.append(db_column)
+
+    return columns
+
+
 def set_clamp_filter(logger: Logger, config: ConfigAgent):
     '''Creates a filter for the sqlalchemy call to read only the specified data range'''
     logger.debug('Building clamp filter')
@@ -86,51 +121,54 @@ def collection_to_df(data: pd.DataFrame, palette_range: int, include_backbone: b
         dataframe
     '''
     if not include_backbone:
-        data = data.drop(data[data['is_bb'] == True].index)
-    # add coloration index column
-    rawdict = data.to_dict(orient='records')
-    data_dict = {}
-    data_dict['value'] = []
-    data_dict['is_bb'] = []
-    data_dict['full_path'] = []
-    data_dict['dist'] = []
-    data_dict['dist_to_bb'] = []
-    data_dict['closest_vert'] = []
-    data_dict['closest_vert_value'] = []
-    data_dict['peak'] = []
-    data_dict['peak_slope'] = []
-    data_dict['odd_parent'] = []
-    data_dict['bounded'] = []
-    data_dict['color_bucket'] = []
-
+        data = data[~data['is_bb'].astype(bool)]
     max_value = (data[colorization_field].max())
 
     # check for values
     if max_value == 0:
         return None
 
-    with Bar('Generating plot data', max=len(rawdict)) as bar:
-        for item in rawdict:
-            data_dict['value'].append(item['value'])
-            data_dict['is_bb'].append('True' if item['is_bb'] else 'False')
-            data_dict['full_path'].append(item['full_path'])
-            data_dict['dist'].append(item['dist'])
-            data_dict['dist_to_bb'].append(item['dist_to_bb'])
-            data_dict['closest_vert'].append(item['closest_vert'])
-            data_dict['closest_vert_value'].append(item['closest_vert_value'])
-            data_dict['peak'].append(item['peak'])
-            data_dict['peak_slope'].append(item['peak_slope'])
-            data_dict['odd_parent'].append('True' if item['odd_parent'] else 'False')
-            data_dict['bounded'].append('True' if item['peak'] <= limit else 'False')
-            data_dict['color_bucket'].append(get_colour_bucket_index(
-                item[colorization_field], max_value, palette_range))
-            bar.next()
+    # the flags and color buckets are categorical, one byte per row; the string labels are only built for the plot payload
+    flag_labels = ['False', 'True']
+    data_dict = {}
+    for column in data.columns:
+        if column in ['is_bb', 'odd_parent']:
+            data_dict[column] = pd.Categorical.from_codes(data[column].to_numpy(dtype=np.int8), categories=flag_labels)
+        else:
+            data_dict[column] = data[column].to_numpy()
+    if 'peak' in data:
+        data_dict['bounded'] = pd.Categorical.from_codes((data['peak'].to_numpy() <= limit).astype(np.int8), categories=flag_labels)
+    color_bucket_indexes = get_colour_bucket_indexes(data[colorization_field].to_numpy(), max_value, palette_range)
+    data_dict['color_bucket'] = pd.Categorical.from_codes(color_bucket_indexes, categories=get_color_factors(palette_range + 1))
 
     data_df = pd.DataFrame(data_dict)
 
     return data_df
 
 
+def get_colour_bucket_indexes(values: np.ndarray, max: int, palette_range: int) -> np.ndarray:
+    '''
+    Get the indexes of the color buckets for a column of values, see get_colour_bucket_index
+
+    Params
+    ------
+    values: np.ndarray
+        the values to be used for assignment
+    max: int
+        maximum for the value within the collection
+    palette_range: int
+        maximum number of color buckets to be used
+
+    Returns
+    ------
+    np.ndarray
+        int color indexes, from 0 to palette_range (for the maximum)
+    '''
+    if values.dtype == bool:
+        values = values.astype(np.int64)
+    return np.floor((palette_range * values) / max).astype(np.int64)
+
+
 def get_colour_bucket_index(value: int, max: int, palette_range: int) -> int:
     '''
     Get the index of the color bucket that a number with a given value should be assigned to
@@ -154,28 +192,121 @@ def get_colour_bucket_index(value: int, max: int, palette_range: int) -> int:
     return color_index
 
 
+def decimate_data(config: ConfigAgent, data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Reduces the plot data to a point budget, keeping its visual structure
+
+    The points are binned along value at the plot width and along the y axis at the plot height;
+    one point is kept per bin and color, together with the min and max y point of each value bin.
+    The bins are coarsened until the kept points fit in the budget
+
+    Params
+    ------
+    config: ConfigAgent
+        config agent instance
+    data: pd.DataFrame
+        prepared plot data
+
+    Returns
+    ------
+    pd.DataFrame
+        the kept points, in value order
+    '''
+    point_budget = config.plot.point_budget
+    if len(data) <= point_budget:
+        return data
+    x_values = data['value'].to_numpy()
+    y_values = data[mappings.y_axis_parameter[config.plot.y_axis]].to_numpy().astype(np.float64)
+    colors = data['color_bucket'].cat.codes.to_numpy().astype(np.int64)
+    color_count = colors.max() + 1
+    x_span = max(x_values.max() - x_values.min(), 1)
+    y_span = max(y_values.max() - y_values.min(), 1)
+    x_bin_count = config.plot.width
+    y_bin_count = config.plot.height
+    point_indexes = np.arange(len(data))
+    while True:
+        x_bins = np.minimum(((x_values - x_values.min()) * x_bin_count) // x_span, x_bin_count - 1).astype(np.int64)
+        y_bins = np.minimum(((y_values - y_values.min()) * y_bin_count) // y_span, y_bin_count - 1).astype(np.int64)
+        cells = (x_bins * y_bin_count + y_bins) * color_count + colors
+        is_kept = np.zeros(len(data), dtype=bool)
+        is_kept[get_bin_representatives(cells, point_indexes, x_bin_count * y_bin_count * color_count)] = True
+        # the extremes of each value bin
+        for reduce, initial in [(np.minimum, np.inf), (np.maximum, -np.inf)]:
+            extremes = np.full(x_bin_count, initial)
+            reduce.at(extremes, x_bins, y_values)
+            is_extreme = y_values == extremes[x_bins]
+            is_kept[get_bin_representatives(x_bins[is_extreme], point_indexes[is_extreme], x_bin_count)] = True
+        kept = np.flatnonzero(is_kept)
+        if len(kept) <= point_budget or (x_bin_count == 1 and y_bin_count == 1):
+            break
+        scale = max(np.sqrt(point_budget / len(kept)), 0.5)
+        x_bin_count = max(int(x_bin_count * scale), 1)
+        y_bin_count = max(int(y_bin_count * scale), 1)
+
+    return data.iloc[kept].reset_index(drop=True)
+
+
+def get_bin_representatives(bins: np.ndarray, point_indexes: np.ndarray, bin_count: int) -> np.ndarray:
+    '''Picks the index of one point for each occupied bin'''
+    representatives = np.empty(bin_count, dtype=np.int64)
+    representatives[bins] = point_indexes
+    return representatives[np.bincount(bins, minlength=bin_count) > 0]
+
+
+def get_plot_payload(config: ConfigAgent, data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Trims the plot data to what the html output needs
+
+    Only the axes, the color buckets and the tooltip fields are kept; integer columns are narrowed
+    to int32 when their range allows it, so that bokeh serializes them as compact binary arrays,
+    and the categorical columns are turned into the string labels that the bokeh factors match
+
+    Params
+    ------
+    config: ConfigAgent
+        config agent instance
+    data: pd.DataFrame
+        prepared plot data
+
+    Returns
+    ------
+    pd.DataFrame
+        plot payload
+    '''
+    payload_columns = ['value', mappings.y_axis_parameter[config.plot.y_axis], 'color_bucket'] + list(config.plot.tooltips)
+    columns = {}
+    for column in payload_columns:
+        if column in columns or column not in data:
+            continue
+        if isinstance(data[column].dtype, pd.CategoricalDtype):
+            columns[column] = data[column].astype(str).to_numpy(dtype=object)
+            continue
+        values = data[column].to_numpy()
+        if values.dtype.kind in 'iu' and len(values) > 0:
+            int32_range = np.iinfo(np.int32)
+            if values.min() >= int32_range.min and values.max() <= int32_range.max:
+                values = values.astype(np.int32)
+        columns[column] = values
+
+    return pd.DataFrame(columns)
+
+
 def generate_plot(logger: Logger, config: ConfigAgent, data: pd.DataFrame, project_title: str, html_filepath: str):
     plot = BokehScatterAgent()
+    data = get_plot_payload(config, data)
+    logger.debug(f'Plot payload columns: {", ".join(data.columns)}')
     plot.set_data(data)
     logger.debug('Plot data set')
 
     palette_range = config.plot.palette_range
     config.add_parameter('local', 'plot_points', len(data))
+    config.add_parameter('local', 'plot_payload_bytes', int(data.memory_usage(index=False, deep=True).sum()))
 
     graph_params = get_graph_params(config, logger, project_title, html_filepath)
     plot.set_params(graph_params)
     logger.debug('Graph params collated')
 
-    tooltips = [('number', '@value'), 
-                ('is bb', '@is_bb'), 
-                ('distance', '@dist'), 
-                ('distance to bb', '@dist_to_bb'), 
-                ('closest vert power', '@closest_vert'), 
-                ('closest vert', '@closest_vert_value'), 
-                ('peak', '@peak'), 
-                ('peak slope', '@peak_slope'),
-                ('odd parent', '@odd_parent'),
-                ('bounded', '@bounded')]
+    tooltips = [(mappings.tooltip_labels[field], f'@{field}') for field in config.plot.tooltips]
 
     plot.set_tooltips(tooltips)
     logger.debug('Tooltips set')
@@ -185,6 +316,8 @@ def generate_plot(logger: Logger, config: ConfigAgent, data: pd.DataFrame, proje
     logger.debug('Color factors set')
 
     plot.generate()
+    # the figure is created from the title, axis labels and size only, so the backend is set on it afterwards
+    plot.figure.output_backend = graph_params['output_backend']
     logger.info('Plot generated')
 
     return plot
@@ -230,6 +363,8 @@ def get_graph_params(config: ConfigAgent, logger: Logger, project_title: str, ht
     filter_text = ""
     if config.filters.filter_data:
         filter_text = f" [ filter: {config.local.filter_name} ]"
+    if config.plot.decimate:
+        filter_text += f" [ decimated: {config.local.dropped_points} points dropped ]"
     graph_params['title'] = f'Collatz: {mappings.y_axis_labels[y_axis]} [ Color: {mappings.colorization_title_suffix[colorization_field]} ] [{parameters_title_text}]{backbone_title_text}{filter_text}]'
     graph_params['y_axis_label'] = mappings.y_axis_labels[y_axis]
     graph_params['width'] = plot_width
@@ -240,6 +375,7 @@ def get_graph_params(config: ConfigAgent, logger: Logger, project_title: str, ht
     graph_params['y_axis'] = mappings.y_axis_parameter[y_axis]
     graph_params['output_file_title'] = project_title
     graph_params['output_file_path'] = html_filepath
+    graph_params['output_backend'] = 'webgl' if config.plot.webgl else 'canvas'
 
     return graph_params
 
@@ -276,17 +412,58 @@ def stash_graph_html(hard_copy_filename: str):
             stashed_html_output_file.write(content)
 
 
+def get_stash_filename(config: ConfigAgent, log_filename_prefix: str) -> str:
+    '''Name of the stashed files of a run, without extension'''
+    limit = f"{str(config.local.lower_bound)}_{str(config.local.upper_bound)}"
+    start_string = config.local.start.strftime("%d%m%Y_%H%M%S")
+    return "_".join([log_filename_prefix, limit, start_string])
+
+
+def stash_metrics(config: ConfigAgent, log_filename_prefix: str, metrics: RunMetrics):
+    '''Write the run metrics as JSON next to the stashed log file'''
+    stash_folder = config.local.stash_folder
+    metrics.write(os.path.join(stash_folder, get_stash_filename(config, log_filename_prefix) + ".json"))
+
+
+def get_profiler(config: ConfigAgent, log_filename_prefix: str) -> Profiler:
+    '''
+    The profiler of the run, if the run mode is selected for profiling in the config
+
+    Params
+    ------
+    config: ConfigAgent
+        config agent instance
+    log_filename_prefix: str
+        prefix of the stashed files of the run mode
+
+    Returns
+    ------
+    Profiler
+        profiler writing next to the stashed log file, None if the run is not profiled
+    '''
+    if config.run.profile != config.mode.mode:
+        return None
+    filepath_prefix = os.path.join(config.local.stash_folder, get_stash_filename(config, log_filename_prefix))
+    stage = config.run.profile_stage if config.run.profile_stage else None
+    return Profiler(filepath_prefix, stage, config.run.profile_top)
+
+
+def stash_profile(logger: Logger, config: ConfigAgent, profiler: Profiler):
+    '''Write the profiles and their summary next to the stashed log file'''
+    if profiler is None:
+        return
+    filepaths = profiler.write()
+    logger.info(f'Profile summary: {filepaths[-1]}')
+
+
 def stash_log_file(config: ConfigAgent, log_filename_prefix: str):
     # ensure stash folder exists
-    limit = f"{str(config.local.lower_bound)}_{str(config.local.upper_bound)}"
-    start = config.local.start
     stash_folder = config.local.stash_folder
     logger_filepath = config.local.logger_filepath
     if not os.path.exists(STASH_FOLDER):
         os.makedirs(STASH_FOLDER)
     # copy the latest log file in the stash folder
-    start_string = start.strftime("%d%m%Y_%H%M%S")
-    stashed_log_filename = "_".join([log_filename_prefix, limit, start_string]) + ".log"
+    stashed_log_filename = get_stash_filename(config, log_filename_prefix) + ".log"
     stashed_log_filepath = os.path.join(stash_folder, stashed_log_filename)
     shutil.copy(logger_filepath, stashed_log_filepath)
 
@@ -295,10 +472,7 @@ def stash_log_file(config: ConfigAgent, log_filename_prefix: str):
 
 
 def is_bb(value) -> bool:
-    log2 = np.log2(value)
-    if log2 % 1 == 0:
-        return True
-    return False
+    return is_pow2(value)
 
 
 def prep_output_folder(config: ConfigAgent):
@@ -349,13 +523,20 @@ def generate_timestamp(granularity: int = 0):
     return timestamp_format
 
 
-def filter_data(config: ConfigAgent, data: pd.DataFrame, data_manager: DataManager):
+def get_filter(config: ConfigAgent) -> dict:
+    '''Builds the filter dict set in config.toml'''
     filter = {}
     filter['name'] = config.filters.filter_name
     filter['type'] = DataManager.FilterType(config.filters.filter_type)
     filter['polarity'] = config.filters.filter_polarity
     filter['column'] = config.filters.filter_column
     filter['parameters'] = config.filters.filter_parameters
+    return filter
+
+
+def filter_data(config: ConfigAgent, data: pd.DataFrame, data_manager: DataManager):
+    '''Filters already loaded data in memory'''
+    filter = get_filter(config)
     data_manager.set_data(data)
     data_manager.add_filter(filter)
     filtered_data = data_manager.apply_filter(filter['name'])
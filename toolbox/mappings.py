@@ -40,4 +40,22 @@ colorization_title_suffix = {
     'peak': 'Peak',
     'peak_slope': 'Peak slope',
     'odd_parent': 'Odd parent present'
-}
\ No newline at end of file
+}
+
+tooltip_labels = {
+    'value': 'number',
+    'is_bb': 'is bb',
+    'dist': 'distance',
+    'dist_to_bb': 'distance to bb',
+    'closest_vert': 'closest vert power',
+    'closest_vert_value': 'closest vert',
+    'peak': 'peak',
+    'peak_slope': 'peak slope',
+    'odd_parent': 'odd parent',
+    'bounded': 'bounded'
+}
+
+# plot columns that are not stored in the db, mapped to the stored columns they are derived from
+derived_columns = {
+    'bounded': ['peak']
+}
@@ -0,0 +1,140 @@
+import functools
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import pandas as pd
+
+
+'''
+Per-stage run metrics: wall time, CPU time, peak memory, rows processed and throughput
+
+    metrics = RunMetrics()
+    with metrics.stage('Calculating numbers', logger) as stage:
+        ...
+        stage.rows = len(collection)
+
+Stages can be nested, each record keeps the name of the enclosing stage.
+If a profiler is set for a stage, it is enabled while that stage runs.
+The CPU time of the child processes joined during a stage (e.g. the data writer) is added to it as children_cpu_seconds,
+along with the CPU time of the tasks set as stage.workers (StagePool.stage_metrics), as the pool workers outlive the stages
+'''
+
+
+def get_peak_rss_mb() -> float:
+    '''Peak resident memory of the current process so far, in MB'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_children_cpu_seconds() -> float:
+    '''CPU time of the joined child processes so far'''
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageRecord():
+    def __init__(self, name: str, parent: str = None, rows: int = None):
+        self.name = name
+        self.parent = parent
+        self.rows = rows
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.children_cpu_seconds = None
+        self.peak_rss_mb = None
+        self.workers = []
+        # stage specific figures, e.g. output sizes
+        self.extras = {}
+
+    def to_dict(self) -> dict:
+        record = {
+            'name': self.name,
+            'parent': self.parent,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'children_cpu_seconds': self.children_cpu_seconds,
+            'peak_rss_mb': self.peak_rss_mb,
+            'rows': self.rows,
+            'rows_per_second': self.rows / self.wall_seconds if self.rows is not None and self.wall_seconds else None,
+        }
+        record.update(self.extras)
+        if len(self.workers) > 0:
+            record['workers'] = self.workers
+        return record
+
+
+class RunMetrics():
+    '''Collects the stage records of a run'''
+    def __init__(self, profiler=None):
+        self.stages = []
+        self.active_stages = []
+        self.profiler = profiler
+
+    @contextmanager
+    def stage(self, name: str, logger=None, rows: int = None):
+        '''
+        Measures the enclosed block as a stage
+
+        Params
+        ------
+        name: str
+            name of the stage
+        logger: Logger = None, optional
+            if set, the wall time is logged at debug level when the stage ends
+        rows: int = None, optional
+            number of processed rows, can also be set on the yielded record
+        '''
+        parent = self.active_stages[-1].name if len(self.active_stages) > 0 else None
+        record = StageRecord(name, parent, rows)
+        self.stages.append(record)
+        self.active_stages.append(record)
+        profiled = self.profiler is not None and self.profiler.stage == name and not self.profiler.active
+        if profiled:
+            self.profiler.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        children_cpu_start = get_children_cpu_seconds()
+        try:
+            yield record
+        finally:
+            if profiled:
+                self.profiler.disable()
+            record.wall_seconds = time.perf_counter() - wall_start
+            record.cpu_seconds = time.process_time() - cpu_start
+            workers_cpu_seconds = sum(task['cpu_seconds'] for task in record.workers)
+            record.children_cpu_seconds = get_children_cpu_seconds() - children_cpu_start + workers_cpu_seconds
+            record.peak_rss_mb = get_peak_rss_mb()
+            self.active_stages.pop()
+            if logger is not None:
+                logger.debug(f'...done in {timedelta(seconds=record.wall_seconds)}')
+
+    def to_dict(self) -> dict:
+        return {'stages': [record.to_dict() for record in self.stages]}
+
+    def write(self, filepath: str):
+        '''Writes the metrics as JSON'''
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wt') as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=4)
+
+
+def measured(name: str):
+    '''
+    Decorator measuring a method of an object with a metrics attribute (e.g. DataManager) as a stage
+
+    The rows are taken from the returned DataFrame, or from the DataFrame passed as the first argument
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name) as stage:
+                result = method(self, *args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    stage.rows = len(result)
+                elif len(args) > 0 and isinstance(args[0], pd.DataFrame):
+                    stage.rows = len(args[0])
+            return result
+        return wrapper
+    return decorator
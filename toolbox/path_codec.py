@@ -0,0 +1,123 @@
+import numpy as np
+
+
+'''
+A collatz path is fully determined by its start value and the parity of each step,
+so a path is stored as the step count followed by one bit per step (1 for odd, 3n+1)
+
+blob = [step count: 4 bytes, little endian][parity bits, little endian bit order]
+'''
+
+HEADER_SIZE = 4
+
+
+def encode_path(value: int, path: list) -> bytes:
+    '''
+    Encodes a path as a parity bit blob
+
+    Params
+    ------
+    value: int
+        the start value of the path (not included in the path)
+    path: list
+        the values of the path after the start value
+
+    Returns
+    ------
+    bytes
+        the encoded path
+    '''
+    parities = np.fromiter(((node & 1) for node in [value] + list(path[:-1])), dtype=np.uint8, count=len(path))
+    header = len(path).to_bytes(HEADER_SIZE, 'little')
+    return header + np.packbits(parities, bitorder='little').tobytes()
+
+
+def decode_path(value: int, blob: bytes) -> np.ndarray:
+    '''
+    Rebuilds a path from its start value and its parity bit blob
+
+    Params
+    ------
+    value: int
+        the start value of the path
+    blob: bytes
+        the encoded path
+
+    Returns
+    ------
+    np.ndarray
+        the values of the path after the start value
+    '''
+    length = int.from_bytes(blob[:HEADER_SIZE], 'little')
+    parities = np.unpackbits(np.frombuffer(blob, dtype=np.uint8, offset=HEADER_SIZE), count=length, bitorder='little')
+    path = []
+    node = value
+    for parity in parities.tolist():
+        node = node * 3 + 1 if parity else node >> 1
+        path.append(node)
+
+    return np.array(path)
+
+
+def parse_path_string(path_string: str) -> np.ndarray:
+    '''Rebuilds a path from its comma separated string'''
+    if not path_string:
+        return np.array([], dtype=np.int64)
+    return np.array([int(node) for node in path_string.split(',')])
+
+
+def calculate_path(value: int) -> np.ndarray:
+    '''Iterates a value down to 1, for numbers stored without a path'''
+    path = []
+    node = value
+    while node != 1:
+        node = node * 3 + 1 if node & 1 else node >> 1
+        path.append(node)
+
+    return np.array(path)
+
+
+def get_successor(value: int, limit: int) -> tuple:
+    '''
+    Finds the next node of a path that is below the limit
+
+    Returns
+    ------
+    tuple
+        the successor and the list of nodes above the limit, passed on the way to it
+    '''
+    excursion = []
+    node = value * 3 + 1 if value & 1 else value >> 1
+    while node >= limit:
+        excursion.append(node)
+        node = node * 3 + 1 if node & 1 else node >> 1
+
+    return (node, excursion)
+
+
+def get_successor_steps(value: int, successor, excursion, excursion_bits) -> tuple:
+    '''
+    Rebuilds the nodes of a path from a value up to its successor, from its stored successor pointer
+
+    Params
+    ------
+    value: int
+        the start value of the path
+    successor: int
+        the stored successor, None if it is derived
+    excursion: str
+        the nodes passed above the limit as a comma separated string, as stored by earlier versions
+    excursion_bits: bytes
+        the parity bits of the steps up to the successor, None if the path does not leave the range
+
+    Returns
+    ------
+    tuple
+        the nodes after the value, the successor last
+    '''
+    if excursion_bits is not None:
+        return tuple(decode_path(value, excursion_bits).tolist())
+    if successor is None:
+        return (value * 3 + 1 if value & 1 else value >> 1,)
+    excursion_nodes = tuple(int(node) for node in excursion.split(',')) if excursion else ()
+    return excursion_nodes + (successor,)
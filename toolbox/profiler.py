@@ -0,0 +1,105 @@
+import cProfile
+import glob
+import io
+import os
+import pstats
+import re
+
+
+'''
+Opt-in cProfile profiling of a run, or of one of its stages
+
+The profile of the run process is written to <filepath prefix>.prof; while profiling is active,
+each task of the generator worker processes is profiled as well, into
+<filepath prefix>_<calculator>_task<task index>_pid<worker pid>.prof. The summary of the hot functions,
+for the main process, for each worker process and for all of them, is written to <filepath prefix>_profile.txt
+'''
+
+WORKER_FILEPATH_PATTERN = re.compile(r'_task\d+_pid(\d+)\.prof$')
+
+
+def get_worker_filepath(filepath_prefix: str, calculator_name: str, task_index: int, pid: int) -> str:
+    '''Path of the profile of a task, written by the worker process that ran it'''
+    return f'{filepath_prefix}_{calculator_name}_task{task_index}_pid{pid}.prof'
+
+
+class Profiler():
+    def __init__(self, filepath_prefix: str, stage: str = None, top: int = 30):
+        '''
+        Params
+        ------
+        filepath_prefix: str
+            path of the profile files, without extension
+        stage: str = None, optional
+            name of the metrics stage to profile, None profiles the whole run
+        top: int = 30, optional
+            number of functions listed in the summary
+        '''
+        self.filepath_prefix = filepath_prefix
+        self.stage = stage
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.active = False
+
+    def enable(self):
+        self.active = True
+        self.profile.enable()
+
+    def disable(self):
+        self.profile.disable()
+        self.active = False
+
+    def get_filepaths(self) -> list:
+        '''The written profile files with profiled calls, the run process first'''
+        worker_filepaths = sorted(glob.glob(f'{glob.escape(self.filepath_prefix)}_*_task*_pid*.prof'))
+        # the profile of the run process is empty if the profiled stage did not run
+        run_filepaths = [f'{self.filepath_prefix}.prof'] if len(self.profile.stats) > 0 else []
+        return run_filepaths + worker_filepaths
+
+    @staticmethod
+    def get_process_label(filepath: str) -> str:
+        '''Main process or worker pid, from the name of a profile file'''
+        match = WORKER_FILEPATH_PATTERN.search(filepath)
+        return f'Worker pid {match.group(1)}' if match is not None else 'Main process'
+
+    def get_summary(self, filepaths: list, sort_key: str) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(*filepaths, stream=stream)
+        stats.sort_stats(sort_key).print_stats(self.top)
+        return stream.getvalue()
+
+    def write(self) -> list:
+        '''
+        Writes the profile of the run process and the summary of all the profiles
+
+        Returns
+        ------
+        list
+            the paths of the written files, the summary last
+        '''
+        if self.active:
+            self.disable()
+        os.makedirs(os.path.dirname(self.filepath_prefix), exist_ok=True)
+        self.profile.dump_stats(f'{self.filepath_prefix}.prof')
+        filepaths = self.get_filepaths()
+        summary_filepath = f'{self.filepath_prefix}_profile.txt'
+        with open(summary_filepath, 'wt') as summary_file:
+            scope = f'stage {self.stage}' if self.stage else 'whole run'
+            summary_file.write(f'Profiled: {scope}\n\n')
+            if len(filepaths) == 0:
+                summary_file.write('No calls were profiled, the stage did not run\n')
+            else:
+                # a worker process can run several tasks, its profiles are summarized together
+                process_filepaths = {}
+                summary_file.write('Profile files\n')
+                for filepath in filepaths:
+                    label = self.get_process_label(filepath)
+                    process_filepaths.setdefault(label, []).append(filepath)
+                    summary_file.write(f'* {label}: {os.path.basename(filepath)}\n')
+                for label, label_filepaths in process_filepaths.items():
+                    summary_file.write(f'\n{label}, top {self.top} by cumulative time\n')
+                    summary_file.write(self.get_summary(label_filepaths, 'cumulative'))
+                summary_file.write(f'\nAll processes, top {self.top} by own time\n')
+                summary_file.write(self.get_summary(filepaths, 'tottime'))
+
+        return filepaths + [summary_filepath]
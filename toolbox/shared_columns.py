@@ -0,0 +1,58 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedColumns():
+    '''
+    Fixed width columns in shared memory, one row per value
+
+    The creating process hands get_spec() to the other processes, which attach to the columns and read or write
+    their rows in place, so the rows are never pickled; the arrays wrap the shared memory without copying.
+    The columns are freed with release(), by one of the processes, once none of them needs the columns anymore
+    '''
+    def __init__(self, length: int, dtypes: dict, names: dict = None):
+        '''
+        Params
+        ------
+        length: int
+            number of rows
+        dtypes: dict
+            numpy dtype of each column
+        names: dict = None, optional
+            shared memory name of each column, to attach to existing columns; None creates them
+        '''
+        self.length = length
+        self.dtypes = dtypes
+        self.memory = {}
+        self.arrays = {}
+        for column, dtype in dtypes.items():
+            if names is None:
+                # a shared memory segment can not be empty
+                memory = shared_memory.SharedMemory(create=True, size=max(length, 1) * np.dtype(dtype).itemsize)
+            else:
+                memory = shared_memory.SharedMemory(name=names[column])
+            self.memory[column] = memory
+            self.arrays[column] = np.ndarray((length,), dtype=dtype, buffer=memory.buf)
+
+    @classmethod
+    def attach(cls, spec: dict):
+        '''Attach to columns created in another process'''
+        return cls(spec['length'], spec['dtypes'], names=spec['names'])
+
+    def get_spec(self) -> dict:
+        '''Picklable description of the columns, used by the other processes to attach'''
+        names = {column: memory.name for column, memory in self.memory.items()}
+        return {'length': self.length, 'dtypes': self.dtypes, 'names': names}
+
+    def close(self):
+        '''Detach from the shared memory; arrays taken from the columns can not be used afterwards'''
+        self.arrays = {}
+        for memory in self.memory.values():
+            memory.close()
+
+    def release(self):
+        '''Detach from and free the shared memory'''
+        for memory in self.memory.values():
+            memory.unlink()
+        self.close()
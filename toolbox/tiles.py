@@ -0,0 +1,216 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+'''
+Multi-resolution aggregates of the number properties, stored as tiles
+
+Level 0 holds one bin per value, each next level merges zoom_factor bins of the previous one;
+a bin keeps the count of the stored numbers and the min, max and sum of each property.
+A tile holds tile_size consecutive bins of a level, bins are counted from value 0
+
+<tiles folder>/pyramid.json
+<tiles folder>/level_<level>/tile_<index>.npz
+'''
+
+PROPERTIES = ['dist', 'dist_to_bb', 'peak_slope']
+META_FILENAME = 'pyramid.json'
+BIN_COLUMNS = ['bin_start', 'bin_end', 'count'] + [f'{property}_{statistic}' for property in PROPERTIES for statistic in ['min', 'max', 'mean']]
+
+
+def get_empty_bins(length: int) -> dict:
+    '''Aggregates of empty bins'''
+    bins = {'count': np.zeros(length, dtype=np.int64)}
+    for property in PROPERTIES:
+        bins[f'{property}_min'] = np.full(length, np.inf)
+        bins[f'{property}_max'] = np.full(length, -np.inf)
+        bins[f'{property}_sum'] = np.zeros(length)
+    return bins
+
+
+def reduce_bins(bins: dict, factor: int) -> dict:
+    '''Merges each factor consecutive bins into one'''
+    reduced = {}
+    for name, column in bins.items():
+        grouped = column.reshape(-1, factor)
+        if name.endswith('_min'):
+            reduced[name] = grouped.min(axis=1)
+        elif name.endswith('_max'):
+            reduced[name] = grouped.max(axis=1)
+        else:
+            reduced[name] = grouped.sum(axis=1)
+    return reduced
+
+
+def get_tile_filepath(folder: str, level: int, tile_index: int) -> str:
+    return os.path.join(folder, f'level_{level}', f'tile_{tile_index}.npz')
+
+
+class TileWriter():
+    '''
+    Builds the tile pyramid from number properties, streamed in value order
+
+    Only one pending tile per level is kept in memory; a tile is written when the data moves past it
+    and its reduced bins are merged in the pending tile of the next level
+    '''
+    def __init__(self, folder: str, tile_size: int = 4096, zoom_factor: int = 4):
+        if tile_size % zoom_factor != 0:
+            raise ValueError('The tile size should be a multiple of the zoom factor')
+        self.folder = folder
+        self.tile_size = tile_size
+        self.zoom_factor = zoom_factor
+        self.pending = {}
+        self.tiles = {}
+        self.lower = None
+        self.upper = None
+
+    def add_data(self, data: pd.DataFrame):
+        '''Adds the properties of numbers with values above the already added ones'''
+        if len(data) == 0:
+            return
+        values = data['value'].to_numpy(dtype=np.int64)
+        if self.upper is not None and values[0] < self.upper:
+            raise ValueError('The data should be added in value order')
+        if self.lower is None:
+            self.lower = int(values[0])
+        self.upper = int(values[-1]) + 1
+        tile_indexes = values // self.tile_size
+        tile_starts = np.flatnonzero(np.diff(tile_indexes, prepend=-1))
+        tile_ends = np.append(tile_starts[1:], len(values))
+        for start, end in zip(tile_starts, tile_ends):
+            tile_index = int(tile_indexes[start])
+            bins = self.get_pending(0, tile_index)
+            rows = values[start:end] - tile_index * self.tile_size
+            bins['count'][rows] = 1
+            for property in PROPERTIES:
+                column = data[property].to_numpy(dtype=np.float64)[start:end]
+                bins[f'{property}_min'][rows] = column
+                bins[f'{property}_max'][rows] = column
+                bins[f'{property}_sum'][rows] = column
+
+    def get_pending(self, level: int, tile_index: int) -> dict:
+        '''The bins of the pending tile of a level, flushing the previous pending tile when the data moved past it'''
+        if level in self.pending:
+            pending_index, bins = self.pending[level]
+            if pending_index == tile_index:
+                return bins
+            self.flush(level)
+        bins = get_empty_bins(self.tile_size)
+        self.pending[level] = (tile_index, bins)
+        return bins
+
+    def flush(self, level: int, is_last: bool = False):
+        '''Writes the pending tile of a level and merges it into the next level'''
+        tile_index, bins = self.pending.pop(level)
+        tile_filepath = get_tile_filepath(self.folder, level, tile_index)
+        os.makedirs(os.path.dirname(tile_filepath), exist_ok=True)
+        np.savez(tile_filepath, **bins)
+        self.tiles.setdefault(level, []).append(tile_index)
+        # a level that fits in a single tile is the top of the pyramid
+        if is_last and len(self.tiles[level]) == 1:
+            return
+        reduced_length = self.tile_size // self.zoom_factor
+        parent_bins = self.get_pending(level + 1, tile_index // self.zoom_factor)
+        offset = (tile_index % self.zoom_factor) * reduced_length
+        for name, column in reduce_bins(bins, self.zoom_factor).items():
+            parent_bins[name][offset:offset + reduced_length] = column
+
+    def close(self) -> dict:
+        '''Writes the pending tiles of all levels and the pyramid description'''
+        level = 0
+        while level in self.pending:
+            self.flush(level, is_last=True)
+            level += 1
+        meta = {
+            'tile_size': self.tile_size,
+            'zoom_factor': self.zoom_factor,
+            'lower': self.lower,
+            'upper': self.upper,
+            'levels': len(self.tiles),
+            'properties': PROPERTIES,
+            'tiles': {str(level): sorted(indexes) for level, indexes in self.tiles.items()},
+        }
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, META_FILENAME), 'wt') as meta_file:
+            json.dump(meta, meta_file, indent=4)
+        return meta
+
+
+class TilePyramid():
+    '''Reads the bins of the tile pyramid for a value range, at the level that matches the zoom'''
+    def __init__(self, folder: str, cache_size: int = 256):
+        self.folder = folder
+        with open(os.path.join(folder, META_FILENAME), 'rt') as meta_file:
+            self.meta = json.load(meta_file)
+        self.tile_size = self.meta['tile_size']
+        self.zoom_factor = self.meta['zoom_factor']
+        self.levels = self.meta['levels']
+        self.tiles = {int(level): set(indexes) for level, indexes in self.meta['tiles'].items()}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def get_bin_width(self, level: int) -> int:
+        return self.zoom_factor ** level
+
+    def get_level(self, lower: int, upper: int, max_bins: int) -> int:
+        '''The finest level that shows the value range in at most max_bins bins'''
+        for level in range(self.levels):
+            if (upper - lower) / self.get_bin_width(level) <= max_bins:
+                return level
+        return self.levels - 1
+
+    def load_tile(self, level: int, tile_index: int):
+        '''Loads a tile, keeping the recently used ones in memory; None for tiles without data'''
+        key = (level, tile_index)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if tile_index not in self.tiles.get(level, set()):
+            return None
+        with np.load(get_tile_filepath(self.folder, level, tile_index)) as tile_file:
+            bins = {name: tile_file[name] for name in tile_file.files}
+        self.cache[key] = bins
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return bins
+
+    def load_bins(self, level: int, lower: int, upper: int) -> pd.DataFrame:
+        '''
+        Loads the non-empty bins of a level that overlap the value range [lower, upper)
+
+        Returns
+        ------
+        pd.DataFrame
+            bin_start, bin_end, count and the min, max and mean of each property
+        '''
+        bin_width = self.get_bin_width(level)
+        lower = max(lower, self.meta['lower'])
+        upper = min(upper, self.meta['upper'])
+        if lower >= upper:
+            return pd.DataFrame(columns=BIN_COLUMNS)
+        first_bin = lower // bin_width
+        last_bin = (upper - 1) // bin_width
+        parts = []
+        for tile_index in range(first_bin // self.tile_size, last_bin // self.tile_size + 1):
+            bins = self.load_tile(level, tile_index)
+            if bins is None:
+                continue
+            tile_first_bin = tile_index * self.tile_size
+            start = max(first_bin - tile_first_bin, 0)
+            end = min(last_bin - tile_first_bin + 1, self.tile_size)
+            part = {'bin_start': (np.arange(start, end) + tile_first_bin) * bin_width}
+            part.update({name: column[start:end] for name, column in bins.items()})
+            parts.append(pd.DataFrame(part))
+        if len(parts) == 0:
+            return pd.DataFrame(columns=BIN_COLUMNS)
+        data = pd.concat(parts, ignore_index=True)
+        data = data[data['count'] > 0].reset_index(drop=True)
+        data['bin_end'] = data['bin_start'] + bin_width
+        for property in PROPERTIES:
+            data[f'{property}_mean'] = data.pop(f'{property}_sum') / data['count']
+
+        return data[BIN_COLUMNS]